@@ -0,0 +1,226 @@
+"""Benchmark the preprocessing, training and prediction stages on synthetic exports.
+
+Usage: python benchmark.py [--visits 10000 100000 ...] [--screening score lifelines]
+                           [--output results.json] [--baseline previous.json]
+
+For every export size, each stage records wall time, peak RSS and rows/s.
+Results are written as JSON (by default to benchmarks/benchmark_<timestamp>.json).
+With --baseline, stages more than --tolerance slower than the baseline run
+are reported and the exit code is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ingest import read_visits
+from readmission import readmission_windows
+from diagnoses import processed_diagnoses
+from preprocessing import READMISSION_WINDOWS, patient_features, apply_reference_date, select_features
+from feature_matrix import feature_matrix, survival_target
+from forest_engine import ForestEngine
+from synthetic_data import write_export
+from metrics import current_rss
+from tasks import DIAGNOSTIC_INTEREST, START_DATE, END_DATE, CASE_TYPES, RSF_PARAMS
+import model_artifact
+
+BENCHMARK_FOLDER = "benchmarks"
+PREDICT_CALLS = 200
+
+
+class Recorder:
+    """Collects one result dict per measured stage."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows):
+        # Sample RSS in the background while the stage runs to find its peak
+        start_rss = current_rss()
+        peak = [start_rss]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.005):
+                peak[0] = max(peak[0], current_rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        extra = {}
+        start = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            wall = time.perf_counter() - start
+            done.set()
+            sampler.join()
+            peak[0] = max(peak[0], current_rss())
+            result = {
+                "stage": name,
+                "rows": int(rows),
+                "wall_s": round(wall, 6),
+                "rows_per_s": round(rows / wall, 1) if wall > 0 else None,
+                "peak_rss_mb": round(peak[0] / 2**20, 1),
+                "rss_delta_mb": round((current_rss() - start_rss) / 2**20, 1),
+            }
+            result.update(extra)
+            self.stages.append(result)
+            print(f"  {name:<28} {wall:9.3f} s  {result['peak_rss_mb']:8.1f} MB peak  {rows:>10} rows")
+
+
+def run_size(n_visits, screening, work_dir, seed=0):
+    recorder = Recorder()
+    export_path = os.path.join(work_dir, f"visits_{n_visits}.csv")
+
+    with recorder.stage("generate", n_visits):
+        write_export(export_path, n_visits, seed)
+
+    # Preprocessing, in the order /fileUpload runs it
+    with recorder.stage("ingest", n_visits):
+        visits = read_visits(export_path, START_DATE, END_DATE, CASE_TYPES)
+
+    interest = visits[visits['Primary Diagnosis Code (Mediclaim)'].str.contains(DIAGNOSTIC_INTEREST, na=False)]
+    with recorder.stage("readmission_windows", len(interest)):
+        readmission_windows(interest, READMISSION_WINDOWS)
+
+    with recorder.stage("processed_diagnoses", len(visits)):
+        processed_diagnoses(visits.assign(**{
+            "Secondary Diagnosis Code Concat (Mediclaim)": visits["Secondary Diagnosis Code Concat (Mediclaim)"].fillna("")
+        }))
+
+    with recorder.stage("patient_features", len(visits)):
+        patients = patient_features(visits, DIAGNOSTIC_INTEREST, READMISSION_WINDOWS)
+
+    with recorder.stage("apply_reference_date", len(patients)):
+        patients = apply_reference_date(patients, datetime.now())
+
+    selected = None
+    for engine in screening:
+        with recorder.stage(f"select_features[{engine}]", len(patients)) as extra:
+            selected = select_features(patients, DIAGNOSTIC_INTEREST, screening=engine)
+            extra["codes"] = len(selected[2])
+    df, matrix, codes = selected
+
+    # Training, with the hyperparameters /train uses
+    from sksurv.ensemble import RandomSurvivalForest
+    from sklearn.model_selection import train_test_split
+
+    feature_columns = [col for col in df.columns if col not in ["Patient ID", "Dead", "Survival Duration (Days)"]] + codes
+    X = feature_matrix(df, matrix, codes, feature_columns)
+    y = survival_target(df["Dead"], df["Survival Duration (Days)"])
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    with recorder.stage("rsf_fit", X_train.shape[0]):
+        rsf = RandomSurvivalForest(**RSF_PARAMS, n_jobs=-1, random_state=42)
+        rsf.fit(X_train, y_train)
+
+    with recorder.stage("rsf_score", X_test.shape[0]) as extra:
+        extra["c_index"] = round(float(rsf.score(X_test, y_test)), 4)
+
+    with recorder.stage("artifact_dump", rsf.n_estimators) as extra:
+        rsf.feature_names_in_ = np.array(feature_columns, dtype=object)
+        artifact = model_artifact.dumps(rsf)
+        extra["artifact_mb"] = round(len(artifact) / 2**20, 3)
+    artifact_path = os.path.join(work_dir, "model.model")
+    with open(artifact_path, "wb") as f:
+        f.write(artifact)
+
+    # Prediction through the engine predict.py and the worker use
+    with recorder.stage("model_load", 1):
+        engine = ForestEngine.load(artifact_path)
+
+    rows = X_test.toarray()
+    latencies = []
+    with recorder.stage("predict_single", PREDICT_CALLS) as extra:
+        for i in range(PREDICT_CALLS):
+            start = time.perf_counter()
+            engine.predict_survival_function(rows[i % len(rows)][None, :])
+            latencies.append(time.perf_counter() - start)
+        extra["p50_ms"] = round(float(np.percentile(latencies, 50)) * 1000, 4)
+        extra["p95_ms"] = round(float(np.percentile(latencies, 95)) * 1000, 4)
+
+    with recorder.stage("predict_batch", X.shape[0]):
+        engine.predict_survival_at(X, [180, 360, 365, 1825])
+
+    return {"visits": n_visits, "patients": len(df), "codes": len(codes), "stages": recorder.stages}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import sklearn
+    import sksurv
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "sksurv": sksurv.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Stages that got slower than the baseline by more than tolerance (0.25 = 25%)
+    previous = {
+        (run["visits"], stage["stage"]): stage["wall_s"]
+        for run in baseline["runs"] for stage in run["stages"]
+    }
+    regressions = []
+    for run in results["runs"]:
+        for stage in run["stages"]:
+            before = previous.get((run["visits"], stage["stage"]))
+            if before and stage["stage"] != "generate" and stage["wall_s"] > before * (1 + tolerance):
+                regressions.append((run["visits"], stage["stage"], before, stage["wall_s"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, training and prediction on synthetic data")
+    parser.add_argument("--visits", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--screening", nargs="+", default=["score"], help="Screening engines to time, the last one feeds training")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "runs": []}
+    with tempfile.TemporaryDirectory(prefix="cgh_benchmark_") as work_dir:
+        for n_visits in args.visits:
+            print(f"{n_visits} visits")
+            results["runs"].append(run_size(n_visits, args.screening, work_dir, args.seed))
+
+    output = args.output or os.path.join(BENCHMARK_FOLDER, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for n_visits, stage, before, after in regressions:
+            print(f"REGRESSION {n_visits} visits, {stage}: {before:.3f} s -> {after:.3f} s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import numpy as np
+import scipy.sparse as sp
+
+import model_artifact
+from evaluation import concordance_index
+
+# Ridge penalty of the Cox fit, keeps rare diagnosis codes from diverging
+COX_PENALTY = 0.1
+# Baseline survival points stored in the artifact header at most
+MAX_BASELINE_POINTS = 500
+# Days the dashboard reports, always kept on the grid so their values are exact
+HORIZON_DAYS = (180, 360, 365, 1825)
+
+
+def fit_cox(X, y, feature_names, alpha=COX_PENALTY, max_points=MAX_BASELINE_POINTS, horizons=HORIZON_DAYS):
+    """Fit a Cox model next to the forest and return it as a plain dict for the artifact header.
+
+    The dict holds the coefficients in feature_names order and the baseline
+    survival S0(t) on about max_points days (always including the horizons), so
+    S(t | x) = S0(t) ** exp(x . coef) can be served without sksurv.
+    Rows of X follow y (sksurv's structured array).
+    """
+    from sksurv.linear_model import CoxPHSurvivalAnalysis
+
+    X = X.toarray() if sp.issparse(X) else np.asarray(X)
+    cph = CoxPHSurvivalAnalysis(alpha=alpha, ties="breslow")
+    cph.fit(X.astype(np.float64), y)
+
+    baseline = cph.baseline_survival_
+    times = np.asarray(baseline.x, dtype=np.float64)
+    if len(times) > max_points:
+        # Keep the days at evenly spaced quantiles of the event times, the horizons and the last day
+        horizons = [days for days in horizons if times[0] <= days <= times[-1]]
+        times = np.unique(np.concatenate([np.quantile(times, np.linspace(0, 1, max_points)), horizons, [times[-1]]]))
+    survival = baseline(times)
+    if times[0] > 0:
+        # Everyone is alive at day 0
+        times, survival = np.append(0.0, times), np.append(1.0, survival)
+    return {
+        "feature_names": [str(name) for name in feature_names],
+        "coef": cph.coef_.tolist(),
+        "times": times.tolist(),
+        "baseline_survival": survival.tolist(),
+        "alpha": alpha,
+    }
+
+
+def fit_cox_predictor(X_train, y_train, X_test, y_test, feature_names):
+    """fit_cox with the test concordance under "c_index", or None when the fit fails.
+
+    The Cox predictor is only an optional fast mode, so a singular or
+    degenerate cohort must not fail the forest training; the model is then
+    stored without it.
+    """
+    try:
+        cox = fit_cox(X_train, y_train, feature_names)
+        risk = CoxPredictor({"cox": cox}).predict(X_test)
+    except (ValueError, ArithmeticError, np.linalg.LinAlgError) as e:
+        print(f"Cox predictor not stored, the fit failed: {e}")
+        return None
+    cox["c_index"] = round(concordance_index(y_test["Dead"], y_test["Survival Duration (Days)"], risk), 4)
+    return cox
+
+
+class CoxUnavailable(ValueError):
+    pass
+
+
+class CoxPredictor:
+    """Closed-form Cox survival from the "cox" entry of a model artifact header.
+
+    Offers the parts of ForestEngine that predict.py uses (feature_index,
+    codes, unique_times_, predict_survival_function and predict), so the
+    dashboard can switch between the two. Only the JSON header is read.
+    """
+
+    def __init__(self, header):
+        cox = header.get("cox")
+        if cox is None:
+            raise CoxUnavailable("Cox mode is unavailable for this model, no Cox predictor was stored with it")
+        self.header = header
+        self.feature_names_in_ = np.array(cox["feature_names"], dtype=object)
+        self.feature_index = {name: i for i, name in enumerate(cox["feature_names"])}
+        self.n_features_in_ = len(cox["feature_names"])
+        self.codes = header.get("codes")
+        self.coef = np.array(cox["coef"], dtype=np.float64)
+        self.unique_times_ = np.array(cox["times"], dtype=np.float64)
+        self.baseline_survival = np.array(cox["baseline_survival"], dtype=np.float64)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if not model_artifact.is_artifact(f.read(len(model_artifact.MAGIC))):
+                raise CoxUnavailable("Cox mode is unavailable for models saved before the artifact format")
+        return cls(model_artifact.read_header(path))
+
+    def predict(self, X):
+        # Linear predictor x . coef, the Cox risk score
+        return np.asarray(X @ self.coef).ravel()
+
+    def predict_survival_function(self, X, return_array=True):
+        if not return_array:
+            raise ValueError("CoxPredictor only returns arrays")
+        return self.baseline_survival[None, :] ** np.exp(self.predict(X))[:, None]
+
+    def predict_survival_at(self, X, days):
+        index = np.maximum(np.searchsorted(self.unique_times_, days, side="right") - 1, 0)
+        return self.predict_survival_function(X)[:, index]
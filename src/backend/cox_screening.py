@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.stats import norm
+
+
+def screen_lifelines(matrix, codes, duration, dead, p_value=0.05):
+    # One multivariate lifelines Cox fit on all codes, keeping codes with p <= p_value
+    from lifelines.fitters.coxph_fitter import CoxPHFitter
+
+    cox_df = pd.DataFrame(matrix.toarray() if sp.issparse(matrix) else matrix, columns=codes)
+    cox_df["Dead"] = np.asarray(dead)
+    cox_df["Survival Duration (Days)"] = np.asarray(duration)
+
+    # # Fit the model
+    cph = CoxPHFitter(alpha=0.05)
+    cph.fit(cox_df, 'Survival Duration (Days)', 'Dead')
+    insignificant_codes = set(cph.summary[cph.summary['p'] > p_value].index.tolist())
+    return np.array([code not in insignificant_codes for code in codes], dtype=bool)
+
+
+def score_test(matrix, duration, dead):
+    """Univariate Cox score test of every column at once.
+
+    For each column the score U = sum over events of (x - risk set mean of x)
+    and its information I = sum over events of the risk set variance of x
+    (Breslow ties) are built from per-time sums, reverse-cumulated over the
+    sorted unique times, so the cost is one pass over the non-zeros plus
+    (n_times x n_columns) arithmetic. Returns (z, p_values).
+    """
+    matrix = sp.csr_matrix(matrix, dtype=np.float64)
+    duration = np.asarray(duration, dtype=np.float64)
+    dead = np.asarray(dead).astype(bool)
+    n_rows, n_columns = matrix.shape
+    if n_columns == 0 or not dead.any():
+        return np.zeros(n_columns), np.ones(n_columns)
+
+    # Rows grouped by unique time: (n_times x n_rows) indicator
+    times, time_index = np.unique(duration, return_inverse=True)
+    by_time = sp.csr_matrix((np.ones(n_rows), (time_index, np.arange(n_rows))), shape=(len(times), n_rows))
+    events_by_time = sp.csr_matrix((dead.astype(np.float64), (time_index, np.arange(n_rows))), shape=(len(times), n_rows))
+
+    # Risk set at t: every row with duration >= t
+    at_risk = np.cumsum(np.bincount(time_index, minlength=len(times))[::-1])[::-1].astype(np.float64)
+    risk_sum = np.cumsum((by_time @ matrix).toarray()[::-1], axis=0)[::-1]
+    risk_square_sum = np.cumsum((by_time @ matrix.multiply(matrix)).toarray()[::-1], axis=0)[::-1]
+
+    n_events = np.bincount(time_index, weights=dead.astype(np.float64), minlength=len(times))
+    event_sum = np.asarray((events_by_time @ matrix).sum(axis=0)).ravel()
+
+    risk_mean = risk_sum / at_risk[:, None]
+    score = event_sum - n_events @ risk_mean
+    information = n_events @ (risk_square_sum / at_risk[:, None] - risk_mean ** 2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(information > 0, score / np.sqrt(information), 0.0)
+    return z, 2 * norm.sf(np.abs(z))
+
+
+def screen_score(matrix, codes, duration, dead, p_value=0.05):
+    # Keep codes whose univariate score test has p <= p_value
+    _, p_values = score_test(matrix, duration, dead)
+    return p_values <= p_value
+
+
+def screen_lasso(matrix, codes, duration, dead, p_value=0.05, l1_ratio=1.0, alpha_min_ratio=0.1):
+    """Keep the codes with a non-zero coefficient on a penalized Cox path.
+
+    The path runs from the smallest penalty that zeroes every coefficient down
+    to alpha_min_ratio times it. l1_ratio=1 is the lasso, values below 1 mix
+    in a ridge penalty (elastic net). p_value is not used.
+    """
+    from sksurv.linear_model import CoxnetSurvivalAnalysis
+
+    if matrix.shape[1] == 0:
+        return np.zeros(0, dtype=bool)
+    y = np.zeros(len(duration), dtype=[("Dead", "?"), ("Survival Duration (Days)", "<f8")])
+    y["Dead"] = np.asarray(dead).astype(bool)
+    y["Survival Duration (Days)"] = np.asarray(duration)
+
+    X = matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+    coxnet = CoxnetSurvivalAnalysis(l1_ratio=l1_ratio, alpha_min_ratio=alpha_min_ratio, n_alphas=50)
+    coxnet.fit(X.astype(np.float64), y)
+    return coxnet.coef_[:, -1] != 0
+
+
+SCREENING_ENGINES = {
+    "lifelines": screen_lifelines,
+    "score": screen_score,
+    "lasso": screen_lasso,
+}
@@ -5,6 +5,7 @@ const { Pool } = require("pg");
 const { PythonShell } = require("python-shell");
 const fs = require('fs').promises;
 const path = require('path');
+const crypto = require('crypto');
 
 const app = express();
 app.use(cors());
@@ -19,14 +20,21 @@ const pool = new Pool({
     port: 5432,
 });
 
-// A temp folder is created and check if it exists
-const tempDir = path.join(__dirname, 'temp');
-fs.mkdir(tempDir, { recursive: true }).catch(console.error);
+// Columns the dashboard reads, added by the trainer if it has not run yet
+const schemaReady = pool.query("ALTER TABLE models ADD COLUMN IF NOT EXISTS model_oid OID")
+    .then(() => pool.query("ALTER TABLE diagnostic_codes ADD COLUMN IF NOT EXISTS position INTEGER"))
+    .catch(console.error);
+
+// Models downloaded from the database are kept on disk, uncompressed, as <modelid>-<sha256 of the stored bytes>.model
+const modelStoreDir = process.env.MODEL_STORE_DIR || path.join(__dirname, 'model_store');
+// Total size of the stored models, the least recently used are deleted beyond it
+const modelStoreMaxBytes = Number(process.env.MODEL_STORE_MAX_BYTES || 2 * 1024 ** 3);
 
 // Function to fetch diagnostic codes
 async function getDiagnosticCodes() {
     try {
-        const result = await pool.query("SELECT code_name FROM diagnostic_codes");
+        await schemaReady;
+        const result = await pool.query("SELECT code_name FROM diagnostic_codes ORDER BY position, code_name");
         return result.rows.map(row => row.code_name);
     } catch (error) {
         console.error("Error fetching diagnostic codes:", error);
@@ -44,86 +52,301 @@ app.get("/diagnostic-codes", async (req, res) => {
     }
 });
 
-// Retrieve/Get model
-async function getModel() {
+// Long-lived Python worker that keeps trained models loaded between predictions
+let worker = null;
+let nextRequestId = 1;
+const pendingRequests = new Map();
+// "<modelid>:<mode>" of the models the worker has already loaded
+const loadedModels = new Set();
+// "forest" scores the random survival forest, "cox" the Cox predictor stored with it (fast, for what-if inputs)
+const PREDICTION_MODES = ["forest", "cox"];
+
+function startWorker() {
+    worker = new PythonShell("prediction_worker.py", {
+        mode: "json",
+        pythonOptions: ["-u"],
+        pythonPath: "python",
+    });
+
+    worker.on("message", (message) => {
+        const pending = pendingRequests.get(message.id);
+        if (pending) {
+            pendingRequests.delete(message.id);
+            pending.resolve(message);
+        }
+    });
+
+    worker.on("stderr", (line) => console.error("Prediction worker:", line));
+
+    worker.on("close", () => {
+        // Fail everything in flight and start a fresh worker with an empty model cache
+        pendingRequests.forEach(pending => pending.reject(new Error("Prediction worker exited")));
+        pendingRequests.clear();
+        loadedModels.clear();
+        worker = null;
+    });
+
+    worker.on("pythonError", (err) => console.error("Prediction worker error:", err));
+}
+
+function sendToWorker(request) {
+    if (!worker) {
+        startWorker();
+    }
+    return new Promise((resolve, reject) => {
+        const id = nextRequestId++;
+        pendingRequests.set(id, { resolve, reject });
+        worker.send({ id, ...request });
+    });
+}
+
+// Retrieve/Get the id of the latest model without transferring the model itself
+async function getLatestModelId() {
     try {
         const result = await pool.query(
-            "SELECT modelid, model_data FROM models ORDER BY timestamp DESC LIMIT 1"
+            "SELECT modelid FROM models ORDER BY timestamp DESC LIMIT 1"
         );
-
-        if (result.rows.length > 0) {
-            return {
-                modelid: result.rows[0].modelid,
-                model_data: result.rows[0].model_data,
-            };
-        } else {
-            return null;
-        }
+        return result.rows.length > 0 ? result.rows[0].modelid : null;
     } catch (error) {
         return null;
     }
 }
 
-// predict
-app.post("/predict", async (req, res) => {
-    const { gender, age, readmissions, diagnosticCodes } = req.body;
+// Retrieve/Get model, newer models are stored as large objects (model_oid)
+async function getModelData(modelid) {
+    await schemaReady;
+    const result = await pool.query(
+        "SELECT COALESCE(model_data, lo_get(model_oid)) AS model_data FROM models WHERE modelid = $1", [modelid]
+    );
+    return result.rows.length > 0 ? result.rows[0].model_data : null;
+}
 
-    if (gender === null || age === null || readmissions === null || diagnosticCodes.length === 0) {
-        return res.status(400).json({ error: "All input fields are required" });
+// modelid -> { path, checksum, size, lastUsed } of the models in the store,
+// lastUsed is a counter so that uses within the same millisecond keep their order
+const storedModels = new Map();
+let useCounter = 0;
+// modelid -> promise of a download in progress, so concurrent requests share it
+const downloads = new Map();
+// modelid -> number of requests that may be handing its file to the worker, never evicted meanwhile
+const modelUsers = new Map();
+
+// Pick up the models stored by earlier runs, oldest files are evicted first
+const modelStoreReady = (async () => {
+    await fs.mkdir(modelStoreDir, { recursive: true });
+    const found = [];
+    for (const name of await fs.readdir(modelStoreDir)) {
+        const match = /^(\d+)-([0-9a-f]{64})\.model$/.exec(name);
+        const filePath = path.join(modelStoreDir, name);
+        if (!match) {
+            // Partial downloads of a server that stopped mid-write
+            if (name.endsWith(".tmp")) {
+                await fs.unlink(filePath).catch(console.error);
+            }
+            continue;
+        }
+        const stat = await fs.stat(filePath);
+        found.push({ modelid: Number(match[1]), filePath, checksum: match[2], size: stat.size, mtime: stat.mtimeMs });
+    }
+    found.sort((a, b) => a.mtime - b.mtime).forEach(({ modelid, filePath, checksum, size }) => {
+        storedModels.set(modelid, { path: filePath, checksum, size, lastUsed: ++useCounter });
+    });
+    await evictModels();
+})().catch(console.error);
+
+async function evictModels(keepModelid = null) {
+    let total = 0;
+    storedModels.forEach(entry => { total += entry.size; });
+    const byAge = [...storedModels.entries()].sort((a, b) => a[1].lastUsed - b[1].lastUsed);
+    for (const [modelid, entry] of byAge) {
+        if (total <= modelStoreMaxBytes) {
+            break;
+        }
+        // Skipped when in use, or already evicted by a concurrent call
+        if (modelid === keepModelid || modelUsers.has(modelid) || !storedModels.has(modelid)) {
+            continue;
+        }
+        storedModels.delete(modelid);
+        total -= entry.size;
+        await fs.unlink(entry.path).catch(console.error);
+    }
+}
+
+async function downloadModel(modelid) {
+    const modelData = await getModelData(modelid);
+    if (!modelData) {
+        return null;
     }
+    const checksum = crypto.createHash("sha256").update(modelData).digest("hex");
+    const filePath = path.join(modelStoreDir, `${modelid}-${checksum}.model`);
+    // The database holds the deflated artifact. The worker writes its raw form to the
+    // store, which it then memory-maps on every load instead of decompressing it
+    const tempPath = `${filePath}.${process.pid}.tmp`;
+    await fs.writeFile(tempPath, modelData);
+    let response;
     try {
-        // Fetch all possible diagnostic codes
-        const allDiagnosticCodes = await getDiagnosticCodes();
+        response = await sendToWorker({ command: "inflate", source: tempPath, target: filePath });
+    } finally {
+        await fs.unlink(tempPath).catch(console.error);
+    }
+    if (response.error) {
+        throw new Error(response.error);
+    }
 
-        // Initialize diagnostic codes to 0
-        let diagnosticInput = {};
-        allDiagnosticCodes.forEach(code => diagnosticInput[code] = 0);
+    const entry = { path: filePath, checksum, size: response.result.size, lastUsed: ++useCounter };
+    storedModels.set(modelid, entry);
+    await evictModels(modelid);
+    return entry;
+}
+
+// Path of the model in the local store, downloading it from the database at most once
+async function getModelPath(modelid) {
+    await modelStoreReady;
+    const entry = storedModels.get(modelid);
+    if (entry) {
+        entry.lastUsed = ++useCounter;
+        return entry.path;
+    }
+    if (!downloads.has(modelid)) {
+        downloads.set(modelid, downloadModel(modelid).finally(() => downloads.delete(modelid)));
+    }
+    const downloaded = await downloads.get(modelid);
+    return downloaded ? downloaded.path : null;
+}
 
-        // Set selected diagnostic codes to 1
-        diagnosticCodes.forEach(code => {
-            if (code in diagnosticInput) {
-                diagnosticInput[code] = 1;
+// Run a prediction, handing the model to the worker only if it does not have it yet
+async function runPrediction(modelid, features, mode = "forest") {
+    const loadedKey = `${modelid}:${mode}`;
+    if (loadedModels.has(loadedKey)) {
+        const response = await sendToWorker({ modelid, mode, ...features });
+        if (response.code !== "model_not_loaded") {
+            return response;
+        }
+        // The worker evicted or lost the model, send it again
+        loadedModels.delete(loadedKey);
+    }
+
+    // The file must stay in the store until the worker has loaded it
+    modelUsers.set(modelid, (modelUsers.get(modelid) || 0) + 1);
+    try {
+        const modelPath = await getModelPath(modelid);
+        if (!modelPath) {
+            return { error: "No trained models found." };
+        }
+
+        const response = await sendToWorker({ modelid, mode, model_path: modelPath, ...features });
+        if (!response.error) {
+            loadedModels.add(loadedKey);
+        } else if (response.code === "model_load_failed") {
+            // A damaged or outdated file, download it again on the next request
+            const entry = storedModels.get(modelid);
+            storedModels.delete(modelid);
+            if (entry) {
+                await fs.unlink(entry.path).catch(console.error);
             }
-        });
+        }
+        return response;
+    } finally {
+        const users = modelUsers.get(modelid) - 1;
+        if (users > 0) {
+            modelUsers.set(modelid, users);
+        } else {
+            modelUsers.delete(modelid);
+            // Evict what was kept for this request, if the store is over its size
+            evictModels().catch(console.error);
+        }
+    }
+}
+
+// Results of recent predictions of the latest model, least recently used are dropped first
+const resultCacheSize = Number(process.env.RESULT_CACHE_SIZE || 1000);
+const resultCacheTtlMs = Number(process.env.RESULT_CACHE_TTL_MS || 10 * 60 * 1000);
+// key -> { result, expires }, a Map keeps insertion order so its first key is the oldest
+const resultCache = new Map();
+const resultCacheStats = { hits: 0, misses: 0, modelid: null };
+
+// The same inputs always give the same key: whole numbers (70 and "70" alike, as the worker reads both)
+// and the codes sorted without duplicates
+function resultCacheKey(modelid, mode, { gender, age, readmissions, diagnostic_codes }) {
+    const canonical = value => Math.trunc(Number(value));
+    const codes = [...new Set(diagnostic_codes.map(String))].sort();
+    return JSON.stringify([modelid, mode, canonical(gender), canonical(age), canonical(readmissions), codes]);
+}
+
+function getCachedResult(modelid, key) {
+    // A new latest model makes every cached result outdated
+    if (resultCacheStats.modelid !== modelid) {
+        resultCache.clear();
+        resultCacheStats.modelid = modelid;
+    }
+    const entry = resultCache.get(key);
+    if (!entry || entry.expires < Date.now()) {
+        resultCache.delete(key);
+        resultCacheStats.misses++;
+        return null;
+    }
+    // Move to the back as the most recently used
+    resultCache.delete(key);
+    resultCache.set(key, entry);
+    resultCacheStats.hits++;
+    return entry.result;
+}
 
-        console.log("Diagnostic Code Mappings:", diagnosticInput);
+function cacheResult(key, result) {
+    resultCache.set(key, { result, expires: Date.now() + resultCacheTtlMs });
+    while (resultCache.size > resultCacheSize) {
+        resultCache.delete(resultCache.keys().next().value);
+    }
+}
+
+app.get("/predict/cache", (req, res) => {
+    res.json({ ...resultCacheStats, size: resultCache.size, max_size: resultCacheSize, ttl_ms: resultCacheTtlMs });
+});
 
+// predict
+app.post("/predict", async (req, res) => {
+    const { gender, age, readmissions, diagnosticCodes, mode = "forest" } = req.body;
+
+    if (gender === null || age === null || readmissions === null || !Array.isArray(diagnosticCodes) || diagnosticCodes.length === 0) {
+        return res.status(400).json({ error: "All input fields are required" });
+    }
+    if (!PREDICTION_MODES.includes(mode)) {
+        return res.status(400).json({ error: `mode must be one of ${PREDICTION_MODES.join(", ")}` });
+    }
+    try {
         // Get latest model
-        const modelData = await getModel();
-        if (!modelData) {
+        const modelid = await getLatestModelId();
+        if (modelid === null) {
             return res.status(404).json({ error: "No trained models found." });
         }
 
-        // Write model data to temp file
-        const tempModelPath = path.join(tempDir, `model_${Date.now()}.pkl`);
-        await fs.writeFile(tempModelPath, modelData.model_data);
+        const features = {
+            gender,
+            age,
+            readmissions,
+            // Only the selected codes, the worker places them by the model's own feature order
+            diagnostic_codes: diagnosticCodes,
+        };
 
-        const formattedCodes = Object.values(diagnosticInput).join(",");
+        // Repeated inputs for the same model are answered without scoring
+        const cacheKey = resultCacheKey(modelid, mode, features);
+        const cached = getCachedResult(modelid, cacheKey);
+        if (cached) {
+            return res.json(cached);
+        }
 
-        // Call Python script for prediction
-        let options = {
-            mode: "json",
-            pythonOptions: ["-u"], 
-            pythonPath: "python",   
-            args: [tempModelPath, gender, age, readmissions, formattedCodes],
-            stderrParser: true
-        };
+        const response = await runPrediction(modelid, features, mode);
 
-        PythonShell.run("predict.py", options)
-            .then(async (results) => {
-                // Clean up temp file
-                await fs.unlink(tempModelPath).catch(console.error);
-
-                if (results && results.length > 0) {
-                    res.json(results[0]);  
-                } else {
-                    res.status(500).json({ error: "No prediction results" });
-                }
-            })
-            .catch(async (err) => {
-                await fs.unlink(tempModelPath).catch(console.error);
-                res.status(500).json({ error: "Prediction failed: " + err.message });
-            });
+        if (response.code === "mode_unavailable") {
+            // e.g. Cox mode for a model whose Cox fit failed, the forest still works
+            res.status(409).json({ error: response.error });
+        } else if (response.error) {
+            res.status(500).json({ error: "Prediction failed: " + response.error });
+        } else {
+            if (resultCacheStats.modelid === modelid) {
+                cacheResult(cacheKey, response.result);
+            }
+            res.json(response.result);
+        }
 
     } catch (error) {
         res.status(500).json({ error: "An error occurred while making predictions." });
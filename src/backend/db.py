@@ -0,0 +1,207 @@
+"""Shared database access for the Flask jobs, train_model.py and migrate_models.py.
+
+Connections come from one pool per process, so a job worker reuses its
+connections across trainings instead of connecting for every request.
+Setting CGH_SQLITE_PATH runs the same functions against a SQLite file
+instead of PostgreSQL, e.g. to try the training pipeline without a server.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_SETTINGS = dict(
+    database=os.environ.get("CGH_DB_NAME", "cghdb"),
+    user=os.environ.get("CGH_DB_USER", "postgres"),
+    password=os.environ.get("CGH_DB_PASSWORD", "cghrespi"),
+    host=os.environ.get("CGH_DB_HOST", "localhost"),
+    port=os.environ.get("CGH_DB_PORT", "5432"),
+)
+POOL_SIZE = int(os.environ.get("CGH_DB_POOL_SIZE", 4))
+SQLITE_PATH = os.environ.get("CGH_SQLITE_PATH")
+
+# Model blobs are written to large objects in chunks of this size
+BLOB_CHUNK_SIZE = 1 << 20
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (userid INTEGER PRIMARY KEY, email TEXT UNIQUE, hashpassword TEXT);
+CREATE TABLE IF NOT EXISTS models (
+    modelid INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, model_data BLOB, c_index REAL,
+    params TEXT, cv_scores TEXT, model_oid INTEGER, metrics TEXT
+);
+CREATE TABLE IF NOT EXISTS diagnostic_codes (code_name TEXT PRIMARY KEY, position INTEGER);
+"""
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_schema_ready = False
+
+
+def get_pool():
+    # One pool per process, job workers forked from the web process start their own
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadedConnectionPool(1, POOL_SIZE, **DB_SETTINGS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def is_sqlite(conn):
+    return isinstance(conn, sqlite3.Connection)
+
+
+def _sql(conn, query):
+    # Queries are written with psycopg2 placeholders
+    return query.replace("%s", "?") if is_sqlite(conn) else query
+
+
+def _json(conn, value):
+    if value is None:
+        return None
+    return json.dumps(value) if is_sqlite(conn) else Json(value)
+
+
+@contextmanager
+def connection():
+    """A pooled connection, committed when the block succeeds and rolled back otherwise."""
+    if SQLITE_PATH:
+        conn = sqlite3.connect(SQLITE_PATH)
+        conn.executescript(SQLITE_SCHEMA)
+    else:
+        pool = get_pool()
+        conn = pool.getconn()
+    try:
+        ensure_schema(conn)
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if SQLITE_PATH:
+            conn.close()
+        else:
+            pool.putconn(conn)
+
+
+def ensure_schema(conn):
+    # Columns added since the tables were created, checked once per process
+    global _schema_ready
+    if _schema_ready or is_sqlite(conn):
+        return
+    cur = conn.cursor()
+    cur.execute("""
+        ALTER TABLE models
+            ADD COLUMN IF NOT EXISTS params JSONB,
+            ADD COLUMN IF NOT EXISTS cv_scores JSONB,
+            ADD COLUMN IF NOT EXISTS model_oid OID,
+            ADD COLUMN IF NOT EXISTS metrics JSONB,
+            ALTER COLUMN model_data DROP NOT NULL
+    """)
+    cur.execute("ALTER TABLE diagnostic_codes ADD COLUMN IF NOT EXISTS position INTEGER")
+    conn.commit()
+    _schema_ready = True
+
+
+def sync_codes(conn, codes):
+    """Make diagnostic_codes hold exactly codes, in that order (the position column).
+
+    Only the difference to the stored vocabulary is written: removed codes
+    are deleted, moved codes get their new position and new codes are added
+    in one batch. Returns (added, removed).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT code_name, position FROM diagnostic_codes")
+    stored = dict(cur.fetchall())
+    wanted = {code: position for position, code in enumerate(codes)}
+
+    removed = [code for code in stored if code not in wanted]
+    moved = [(code, position) for code, position in wanted.items() if code in stored and stored[code] != position]
+    added = [(code, position) for code, position in wanted.items() if code not in stored]
+
+    if is_sqlite(conn):
+        cur.executemany("DELETE FROM diagnostic_codes WHERE code_name = ?", [(code,) for code in removed])
+        cur.executemany("UPDATE diagnostic_codes SET position = ? WHERE code_name = ?", [(p, c) for c, p in moved])
+        cur.executemany("INSERT INTO diagnostic_codes (code_name, position) VALUES (?, ?)", added)
+    else:
+        if removed:
+            cur.execute("DELETE FROM diagnostic_codes WHERE code_name = ANY(%s)", (removed,))
+        if moved:
+            execute_values(cur, """
+                UPDATE diagnostic_codes AS d SET position = v.position
+                FROM (VALUES %s) AS v(code_name, position) WHERE d.code_name = v.code_name
+            """, moved)
+        if added:
+            execute_values(cur, "INSERT INTO diagnostic_codes (code_name, position) VALUES %s", added)
+    return [code for code, _ in added], removed
+
+
+def write_blob(conn, data, chunk_size=BLOB_CHUNK_SIZE):
+    # Stream bytes (or a binary file object) into a new large object and return its oid
+    lobject = conn.lobject(0, "wb")
+    try:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            for start in range(0, len(view), chunk_size):
+                lobject.write(view[start:start + chunk_size])
+        else:
+            for chunk in iter(lambda: data.read(chunk_size), b""):
+                lobject.write(chunk)
+        return lobject.oid
+    finally:
+        lobject.close()
+
+
+def insert_model(conn, model_data, c_index, params=None, cv_scores=None, model_metrics=None, timestamp=None):
+    """Store a model and return its modelid.
+
+    In PostgreSQL the model goes to a large object referenced by model_oid,
+    model_data stays NULL. Older rows keep their bytea model_data.
+    model_metrics (the evaluation report) goes to the metrics column, so
+    model listings can show it without reading the model.
+    """
+    timestamp = timestamp or datetime.now()
+    cur = conn.cursor()
+    if is_sqlite(conn):
+        cur.execute("""
+            INSERT INTO models (timestamp, model_data, c_index, params, cv_scores, metrics) VALUES (?, ?, ?, ?, ?, ?)
+        """, (timestamp.isoformat(), bytes(model_data), c_index, _json(conn, params), _json(conn, cv_scores),
+              _json(conn, model_metrics)))
+        return cur.lastrowid
+
+    oid = write_blob(conn, model_data)
+    cur.execute("""
+        INSERT INTO models (timestamp, model_data, model_oid, c_index, params, cv_scores, metrics)
+        VALUES (%s, NULL, %s, %s, %s, %s, %s)
+        RETURNING modelid;
+    """, (timestamp, oid, c_index, _json(conn, params), _json(conn, cv_scores), _json(conn, model_metrics)))
+    return cur.fetchone()[0]
+
+
+def read_model(conn, modelid):
+    # Model bytes of one row, from model_data or its large object
+    cur = conn.cursor()
+    cur.execute(_sql(conn, "SELECT model_data, model_oid FROM models WHERE modelid = %s"), (modelid,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    model_data, oid = row
+    if model_data is not None or oid is None:
+        return None if model_data is None else bytes(model_data)
+    lobject = conn.lobject(oid, "rb")
+    try:
+        return lobject.read()
+    finally:
+        lobject.close()
+
+
+def update_model_data(conn, modelid, model_data):
+    cur = conn.cursor()
+    cur.execute(_sql(conn, "UPDATE models SET model_data = %s WHERE modelid = %s"), (bytes(model_data), modelid))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+
+def _join_by_key(keys, values, sep):
+    # Join the values of each key in order of appearance, one slice per key
+    # instead of one pandas group object per key
+    codes, uniques = pd.factorize(keys)
+    if len(codes) == 0:
+        return pd.Series([], index=uniques, dtype=object)
+    order = np.argsort(codes, kind='stable')
+    values = values.to_numpy(dtype=object)[order].tolist()
+    bounds = (np.flatnonzero(np.diff(codes[order])) + 1).tolist()
+    starts = [0] + bounds
+    ends = bounds + [len(values)]
+    return pd.Series([sep.join(values[start:end]) for start, end in zip(starts, ends)], index=uniques)
+
+
+def _truncated_codes(diagnosis_str):
+    # Take the first 3 characters of each diagnosis code
+    return [diag[:3] for diag in diagnosis_str.split(',')]
+
+
+def processed_diagnoses(visits, patient_col='Patient ID', primary_col='Primary Diagnosis Code (Mediclaim)',
+                        secondary_col='Secondary Diagnosis Code Concat (Mediclaim)'):
+    """Build the "Processed Diagnoses" string for every visit row.
+
+    Each visit gets its own primary code followed by every distinct secondary
+    code seen for that patient, truncated to 3 characters and deduplicated in
+    order. The secondary codes are split, truncated and deduplicated once per
+    patient, combined once per (patient, primary code) pair and joined back to
+    the visits, so the cost grows linearly with the number of rows.
+
+    The result is the same as building the string
+    "<primary>,<patient secondaries joined by '||'>" per row, replacing '||'
+    with ',', collapsing ',,' once, stripping trailing commas and deduplicating
+    the 3-character prefixes. Returns a Series aligned with visits.index.
+    """
+    # Step 1: '||'-join each patient's distinct secondary codes, in order of appearance
+    secondary = visits[[patient_col, secondary_col]].dropna(subset=[secondary_col]).drop_duplicates()
+    patient_secondary = _join_by_key(secondary[patient_col], secondary[secondary_col], '||')
+
+    # Step 2: split, truncate and dedupe the secondary codes once per patient.
+    # Leading commas are kept apart because they merge with the comma after the primary code.
+    patient_codes = {}
+    for patient_id, combined_secondary in patient_secondary.items():
+        combined_secondary = combined_secondary.replace('||', ',')
+        body = combined_secondary.lstrip(',')
+        leading = len(combined_secondary) - len(body)
+        body = body.replace(',,', ',').rstrip(',')
+        patient_codes[patient_id] = (leading, list(dict.fromkeys(_truncated_codes(body))) if body else [])
+
+    # Step 3: split and truncate each distinct primary code once
+    pairs = visits[[patient_col, primary_col]].drop_duplicates()
+    primary_strs = pairs[primary_col].astype(str).tolist()
+    primary_codes = {}
+    for primary_str in set(primary_strs):
+        primary_body = primary_str.replace('||', ',').rstrip(',')
+        trailing = len(primary_str.replace('||', ',')) - len(primary_body)
+        primary_codes[primary_str] = (trailing, _truncated_codes(primary_body.replace(',,', ',')))
+
+    # Step 4: combine with each distinct primary code of the patient, keeping the primary code first
+    processed = []
+    for patient_id, primary_str in zip(pairs[patient_col].tolist(), primary_strs):
+        leading, secondary_codes = patient_codes.get(patient_id, (0, []))
+        trailing, codes = primary_codes[primary_str]
+        if secondary_codes:
+            # A run of n commas between the codes is left as ceil(n / 2) commas, i.e. empty codes
+            codes = codes + [''] * ((trailing + leading + 2) // 2 - 1) + secondary_codes
+        processed.append(','.join(dict.fromkeys(codes)))
+    pairs = pairs.assign(**{'Processed Diagnoses': processed})
+
+    # Step 5: join back to the visit rows
+    result = visits[[patient_col, primary_col]].merge(pairs, how='left', on=[patient_col, primary_col])
+    return pd.Series(result['Processed Diagnoses'].to_numpy(), index=visits.index, name='Processed Diagnoses')
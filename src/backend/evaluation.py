@@ -0,0 +1,210 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from forest_engine import ForestEngine
+
+# Days the model report gives the time-dependent AUC and Brier score for
+EVALUATION_HORIZONS = (180, 365, 1825)
+BOOTSTRAP_SAMPLES = 200
+BOOTSTRAP_WORKERS = int(os.environ.get("BOOTSTRAP_WORKERS", os.cpu_count() or 1))
+
+
+def _count_smaller_before(rank, is_point, is_query):
+    """For every query item, the points before it with a smaller and with an equal rank.
+
+    Bottom-up merge counting: at level k every block of 2^(k+1) items is split
+    into two halves and each query in the right half counts the points of the
+    left half with one sorted search, so every (point, later query) pair is
+    counted exactly once over the log2(n) levels.
+    """
+    n = len(rank)
+    positions = np.arange(n)
+    base = np.int64(rank.max() + 2) if n else np.int64(1)
+    smaller = np.zeros(n, dtype=np.int64)
+    equal = np.zeros(n, dtype=np.int64)
+    level = 0
+    while (1 << level) < n:
+        block = (positions >> (level + 1)).astype(np.int64)
+        right_half = ((positions >> level) & 1).astype(bool)
+        points = is_point & ~right_half
+        queries = is_query & right_half
+        if points.any() and queries.any():
+            keys = np.sort(block[points] * base + rank[points])
+            start = block[queries] * base
+            lower = np.searchsorted(keys, start, side="left")
+            below = np.searchsorted(keys, start + rank[queries], side="left")
+            through = np.searchsorted(keys, start + rank[queries], side="right")
+            smaller[queries] += below - lower
+            equal[queries] += through - below
+        level += 1
+    return smaller, equal
+
+
+def concordance_index(event, time, risk):
+    """Harrell's concordance index in O(n log^2 n), vectorized.
+
+    Same pairs and tie handling as sksurv's concordance_index_censored (and so
+    rsf.score): an event is compared with every sample that lasted longer and
+    with censored samples at the same time, ties in risk count one half.
+    A Fenwick tree over the risk ranks is O(n log n) but needs a Python loop
+    per sample, which is slower at the sizes the bootstrap scores.
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time, dtype=np.float64)
+    _, rank = np.unique(np.asarray(risk, dtype=np.float64), return_inverse=True)
+
+    # Longest times first; within a time the censored samples, then each event as a
+    # query, then the events themselves, so a query only sees what it is compared with
+    n = len(time)
+    events = np.flatnonzero(event)
+    sample = np.concatenate([np.arange(n), events])
+    phase = np.concatenate([np.where(event, 2, 0), np.ones(len(events), dtype=np.int64)])
+    order = np.lexsort((phase, -time[sample]))
+    sample, phase = sample[order], phase[order]
+    is_query = phase == 1
+
+    smaller, equal = _count_smaller_before(rank[sample].astype(np.int64), ~is_query, is_query)
+    comparable = np.cumsum(~is_query)[is_query].sum()
+    if comparable == 0:
+        return float("nan")
+    return float((smaller[is_query].sum() + 0.5 * equal[is_query].sum()) / comparable)
+
+
+def censoring_survival(event, time):
+    """Kaplan-Meier estimate of the censoring distribution, as (times, survival) steps."""
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time, dtype=np.float64)
+    times, index = np.unique(time, return_inverse=True)
+    at_risk = np.cumsum(np.bincount(index, minlength=len(times))[::-1])[::-1]
+    censored = np.bincount(index, weights=(~event).astype(np.float64), minlength=len(times))
+    # Deaths at a time count as happening before the censorings at that time
+    died = np.bincount(index, weights=event.astype(np.float64), minlength=len(times))
+    at_risk = at_risk - died
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hazard = np.where(at_risk > 0, censored / at_risk, 0.0)
+    return times, np.cumprod(1.0 - hazard)
+
+
+def _censoring_at(censoring, days):
+    # G(days), 1 before the first time; a zero would come from censoring the last sample
+    times, survival = censoring
+    index = np.searchsorted(times, days, side="right") - 1
+    values = np.where(index >= 0, survival[np.maximum(index, 0)], 1.0)
+    return np.where(values > 0, values, np.nan)
+
+
+def cumulative_dynamic_auc(event, time, risk, days, censoring):
+    """Cumulative/dynamic AUC at one horizon with inverse probability of censoring weights.
+
+    Cases died by days, controls were still alive after it. Each case is
+    weighted by 1 / G(its time) and compared with all controls through one
+    sorted search. Returns None when there are no cases or no controls.
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time, dtype=np.float64)
+    risk = np.asarray(risk, dtype=np.float64)
+    cases = event & (time <= days)
+    controls = time > days
+    if not cases.any() or not controls.any():
+        return None
+    weights = 1.0 / _censoring_at(censoring, time[cases])
+    control_risk = np.sort(risk[controls])
+    below = np.searchsorted(control_risk, risk[cases], side="left")
+    through = np.searchsorted(control_risk, risk[cases], side="right")
+    wins = below + 0.5 * (through - below)
+    return float(np.nansum(weights * wins) / (np.nansum(weights) * len(control_risk)))
+
+
+def brier_score(event, time, survival, days, censoring):
+    # Inverse probability of censoring weighted Brier score of the survival at days
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time, dtype=np.float64)
+    survival = np.asarray(survival, dtype=np.float64)
+    died = event & (time <= days)
+    alive = time > days
+    loss = np.zeros(len(time))
+    loss[died] = survival[died] ** 2 / _censoring_at(censoring, time[died])
+    loss[alive] = (1.0 - survival[alive]) ** 2 / _censoring_at(censoring, days)
+    return float(np.nanmean(loss))
+
+
+def metric_values(event, time, risk, survival, horizons, censoring):
+    """Concordance plus AUC and Brier score per horizon, survival is (rows x horizons)."""
+    values = {"c_index": concordance_index(event, time, risk)}
+    for i, days in enumerate(horizons):
+        values[f"auc_{days}"] = cumulative_dynamic_auc(event, time, risk, days, censoring)
+        values[f"brier_{days}"] = brier_score(event, time, survival[:, i], days, censoring)
+    return values
+
+
+def _bootstrap_chunk(seed, n_samples, event, time, risk, survival, horizons, censoring):
+    # Metric values on n_samples resamples of the test rows, in a worker process
+    rng = np.random.default_rng(seed)
+    results = []
+    for _ in range(n_samples):
+        rows = rng.integers(0, len(time), len(time))
+        results.append(metric_values(event[rows], time[rows], risk[rows], survival[rows], horizons, censoring))
+    return results
+
+
+def evaluate(event, time, risk, survival, horizons=EVALUATION_HORIZONS, train_event=None, train_time=None,
+             n_bootstrap=BOOTSTRAP_SAMPLES, workers=BOOTSTRAP_WORKERS, random_state=42):
+    """Model report on the test rows with 95% bootstrap intervals.
+
+    risk is the predicted risk score (rsf.predict) and survival the predicted
+    survival at each horizon. The censoring weights come from the training
+    rows when given, else from the test rows. The bootstrap resamples the
+    test rows, split over a process pool in chunks.
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time, dtype=np.float64)
+    risk = np.asarray(risk, dtype=np.float64)
+    survival = np.asarray(survival, dtype=np.float64).reshape(len(time), len(horizons))
+    horizons = list(horizons)
+    if train_event is None:
+        train_event, train_time = event, time
+    censoring = censoring_survival(train_event, train_time)
+
+    estimates = metric_values(event, time, risk, survival, horizons, censoring)
+    samples = []
+    if n_bootstrap > 0:
+        n_chunks = max(1, min(workers, n_bootstrap))
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(n_bootstrap), n_chunks)]
+        seeds = np.random.SeedSequence(random_state).spawn(n_chunks)
+        args = (event, time, risk, survival, horizons, censoring)
+        if n_chunks == 1:
+            samples = _bootstrap_chunk(seeds[0], sizes[0], *args)
+        else:
+            with ProcessPoolExecutor(max_workers=n_chunks) as pool:
+                futures = [pool.submit(_bootstrap_chunk, seed, size, *args) for seed, size in zip(seeds, sizes)]
+                samples = [values for future in futures for values in future.result()]
+
+    report = {"n_test": int(len(time)), "n_bootstrap": int(n_bootstrap), "horizons": horizons}
+    for name, value in estimates.items():
+        draws = np.array([values[name] for values in samples if values[name] is not None], dtype=np.float64)
+        draws = draws[np.isfinite(draws)]
+        interval = None
+        if len(draws) > 0:
+            interval = [round(float(bound), 4) for bound in np.percentile(draws, [2.5, 97.5])]
+        report[name] = None if value is None or not np.isfinite(value) else round(value, 4)
+        report[f"{name}_ci"] = interval
+    return report
+
+
+def model_report(rsf, X_test, y_test, y_train, horizons=EVALUATION_HORIZONS, n_bootstrap=BOOTSTRAP_SAMPLES):
+    """Report of a fitted forest on the test split, stored with the model.
+
+    "c_index_exact" holds the unrounded concordance, the same value as
+    rsf.score(X_test, y_test).
+    """
+    event, time = y_test["Dead"], y_test["Survival Duration (Days)"]
+    risk = rsf.predict(X_test)
+    survival = ForestEngine.from_model(rsf, horizons).predict_survival_at(X_test, list(horizons))
+    report = evaluate(
+        event, time, risk, survival, horizons,
+        train_event=y_train["Dead"], train_time=y_train["Survival Duration (Days)"], n_bootstrap=n_bootstrap,
+    )
+    report["c_index_exact"] = concordance_index(event, time, risk)
+    return report
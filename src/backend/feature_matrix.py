@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def code_counts(processed_diagnoses):
+    """Number of patients carrying each 3-character diagnosis code.
+
+    processed_diagnoses holds one comma-separated, already deduplicated
+    "Processed Diagnoses" string per patient.
+    """
+    codes = processed_diagnoses.str.split(',').explode()
+    return codes[codes != ''].value_counts()
+
+
+def code_matrix(processed_diagnoses, codes):
+    """One-hot encode the diagnosis strings against a fixed code vocabulary.
+
+    Returns a uint8 CSR matrix with one row per patient and one column per
+    entry of codes, in the same order. Codes outside the vocabulary are ignored.
+    """
+    code_index = {code: i for i, code in enumerate(codes)}
+    exploded = processed_diagnoses.reset_index(drop=True).str.split(',').explode()
+    columns = exploded.map(code_index)
+    known = columns.notna().to_numpy()
+
+    rows = exploded.index.to_numpy()[known]
+    columns = columns.to_numpy()[known].astype(np.int64)
+    data = np.ones(len(rows), dtype=np.uint8)
+    return sp.csr_matrix((data, (rows, columns)), shape=(len(processed_diagnoses), len(codes)), dtype=np.uint8)
+
+
+# Fixed dtypes of the features bundle, other per-patient columns keep their own
+EVENT_COLUMN = "Dead"
+DURATION_COLUMN = "Survival Duration (Days)"
+COLUMN_DTYPES = {EVENT_COLUMN: np.bool_, DURATION_COLUMN: np.float64}
+SURVIVAL_DTYPE = [(EVENT_COLUMN, "?"), (DURATION_COLUMN, "<f8")]
+BUNDLE_VERSION = 1
+
+
+def save_features(path, frame, matrix, codes):
+    """Write the features as a folder of .npy files, one per column.
+
+    The event is stored as bool, the duration as float64 and the code matrix
+    as its uint8 CSR parts, so load_features can memory-map every array
+    instead of parsing or decompressing it.
+    """
+    matrix = sp.csr_matrix(matrix)
+    columns = [col for col in frame.columns if col != "Patient ID"]
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        "patient_ids": frame["Patient ID"].astype(str).to_numpy(dtype=str),
+        "data": matrix.data.astype(np.uint8),
+        # Index arrays keep scipy's own dtype, so loading them needs no cast
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+    }
+    for i, col in enumerate(columns):
+        arrays[f"column_{i}"] = frame[col].to_numpy(dtype=COLUMN_DTYPES.get(col))
+    for name, values in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+    # Written last, a folder without it is incomplete
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"version": BUNDLE_VERSION, "columns": columns, "codes": list(codes), "shape": list(matrix.shape)}, f)
+
+
+def _load_npz(path):
+    # Features files written before the .npy folders
+    with np.load(path) as bundle:
+        frame = pd.DataFrame({"Patient ID": bundle["patient_ids"]})
+        for col in bundle["columns"].tolist():
+            frame[col] = bundle[f"column:{col}"]
+        matrix = sp.csr_matrix((bundle["data"], bundle["indices"], bundle["indptr"]), shape=tuple(bundle["shape"]))
+        codes = bundle["codes"].tolist()
+    return frame, matrix, codes
+
+
+def load_features(path, mmap_mode="r"):
+    """Load a features folder written by save_features (or an older .npz file).
+
+    Returns (frame, matrix, codes): the per-patient columns as a DataFrame,
+    the uint8 CSR code matrix and the code of each matrix column. The arrays
+    are memory-mapped, pass mmap_mode=None to read them into memory.
+    """
+    if not os.path.isdir(path):
+        return _load_npz(path)
+    # A published folder is a symlink to its current version, read every array from that one version
+    path = os.path.realpath(path)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    def array(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    frame = pd.DataFrame({"Patient ID": array("patient_ids")})
+    for i, col in enumerate(meta["columns"]):
+        frame[col] = array(f"column_{i}")
+    matrix = sp.csr_matrix((array("data"), array("indices"), array("indptr")), shape=tuple(meta["shape"]), copy=False)
+    return frame, matrix, meta["codes"]
+
+
+def survival_target(event, duration):
+    # Structured (Dead, Survival Duration (Days)) array sksurv expects, filled column by column
+    y = np.empty(len(event), dtype=SURVIVAL_DTYPE)
+    y[EVENT_COLUMN] = np.asarray(event) == 1
+    y[DURATION_COLUMN] = np.asarray(duration, dtype=np.float64)
+    return y
+
+
+def feature_matrix(frame, matrix, codes, columns):
+    """Model input for the given feature order, as a float32 CSR matrix.
+
+    columns may name per-patient columns of frame and codes of matrix, in any order.
+    """
+    code_index = {code: i for i, code in enumerate(codes)}
+    missing = [col for col in columns if col not in code_index and col not in frame.columns]
+    if missing:
+        raise ValueError(f"Features are missing columns: {missing}")
+
+    base_columns = [col for col in columns if col not in code_index]
+    combined = sp.hstack([
+        sp.csr_matrix(frame[base_columns].to_numpy(dtype=np.float32)),
+        matrix.astype(np.float32),
+    ], format="csr")
+
+    # Position of every requested column in [base columns..., codes...]
+    position = {col: i for i, col in enumerate(base_columns)}
+    order = [position[col] if col in position else len(base_columns) + code_index[col] for col in columns]
+    return combined[:, order]
+
+
+def to_dataframe(frame, matrix, codes):
+    # Dense table for the CSV download, with uint8 code columns and 0/1 flags
+    code_df = pd.DataFrame(matrix.toarray(), columns=codes, index=frame.index)
+    frame = frame.assign(**{col: frame[col].astype(np.int64) for col in frame.columns if frame[col].dtype == bool})
+    return pd.concat([frame, code_df], axis=1)
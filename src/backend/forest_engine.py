@@ -0,0 +1,139 @@
+import pickle
+
+import numpy as np
+import scipy.sparse as sp
+
+import model_artifact
+
+# Days the dashboard asks for on every prediction, looked up once per leaf when a model is loaded
+DEFAULT_HORIZONS = (180, 360, 365, 1825)
+
+
+class ForestEngine:
+    """Random survival forest inference with NumPy over the model artifact arrays.
+
+    All trees live in one set of node arrays, so a batch of rows walks every
+    tree at once, one level per step. The forest curve is the mean of the
+    leaf curves, computed as one sparse (rows x leaves) product with the leaf
+    table instead of one StepFunction per row. Values match sksurv up to the
+    float32 rounding of the stored curves.
+    """
+
+    def __init__(self, header, arrays, horizons=DEFAULT_HORIZONS):
+        self.header = header
+        self.unique_times_ = np.array(header["unique_times"], dtype=np.float64)
+        self.is_event_time_ = np.array(header["is_event_time"], dtype=bool)
+        self.n_features_in_ = header["n_features"]
+        # Column of each feature by name, and the diagnosis codes among them when the model stored them
+        self.feature_index = {}
+        if header.get("feature_names") is not None:
+            self.feature_names_in_ = np.array(header["feature_names"], dtype=object)
+            self.feature_index = {name: i for i, name in enumerate(header["feature_names"])}
+        self.codes = header.get("codes")
+        self.n_trees = len(arrays["tree_offsets"]) - 1
+        self.max_depth = int(arrays["max_depth"].max()) if self.n_trees else 0
+
+        # Children become global node indices and leaves point at themselves,
+        # so rows that reached a leaf stay there while the others keep walking
+        tree_offsets = arrays["tree_offsets"]
+        offsets = np.repeat(tree_offsets[:-1], np.diff(tree_offsets))
+        leaf_index = arrays["leaf_index"]
+        is_leaf = leaf_index >= 0
+        node_ids = np.arange(len(leaf_index), dtype=np.int64)
+        self.roots = tree_offsets[:-1].astype(np.int64)
+        self.left = np.where(is_leaf, node_ids, arrays["children_left"] + offsets)
+        self.right = np.where(is_leaf, node_ids, arrays["children_right"] + offsets)
+        self.feature = np.where(is_leaf, 0, arrays["feature"]).astype(np.intp)
+        self.threshold = np.where(is_leaf, np.inf, arrays["threshold"])
+        self.missing_go_to_left = arrays["missing_go_to_left"].astype(bool)
+        self.is_leaf = is_leaf
+        self.leaf_index = leaf_index
+
+        # Per-leaf tables; leaf_survival may stay memory-mapped
+        self.leaf_survival = arrays["leaf_survival"]
+        self.leaf_chf = arrays["leaf_chf"]
+        self.leaf_risk = arrays["leaf_chf"][:, self.is_event_time_].sum(axis=1, dtype=np.float64)
+        self.horizons = {}
+        self.horizon_survival = np.empty((len(self.leaf_survival), 0), dtype=np.float32)
+        self.add_horizons(horizons)
+
+    @classmethod
+    def from_model(cls, rsf, horizons=DEFAULT_HORIZONS):
+        # Engine for a fitted sksurv forest, e.g. a model pickled before the artifact format
+        return cls(model_artifact.forest_header(rsf), model_artifact.forest_arrays(rsf), horizons)
+
+    @classmethod
+    def load(cls, path, horizons=DEFAULT_HORIZONS):
+        with open(path, "rb") as f:
+            start = f.read(len(model_artifact.MAGIC))
+        if not model_artifact.is_artifact(start):
+            with open(path, "rb") as f:
+                return cls.from_model(pickle.load(f), horizons)
+        return cls(*model_artifact.load(path), horizons)
+
+    def time_index(self, days):
+        # Same lookup as sksurv's StepFunction, days before the first time take the first value
+        return max(int(np.searchsorted(self.unique_times_, days, side="right")) - 1, 0)
+
+    def add_horizons(self, horizons):
+        new = [days for days in horizons if days not in self.horizons]
+        if not new:
+            return
+        columns = [self.time_index(days) for days in new]
+        start = self.horizon_survival.shape[1]
+        self.horizon_survival = np.hstack([self.horizon_survival, self.leaf_survival[:, columns]])
+        self.horizons.update({days: start + i for i, days in enumerate(new)})
+
+    def _check_input(self, X):
+        if sp.issparse(X):
+            X = X.toarray()
+        # Trees compare float32 inputs, as sklearn does
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[-1]} features, but the model expects {self.n_features_in_}")
+        return X
+
+    def apply(self, X):
+        """Leaf row (into the leaf tables) of every tree for every row, shape (n_rows, n_trees)."""
+        X = self._check_input(X)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            go_left = values <= self.threshold[nodes]
+            missing = np.isnan(values)
+            if missing.any():
+                go_left = np.where(missing, self.missing_go_to_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            if self.is_leaf[nodes].all():
+                break
+        return self.leaf_index[nodes]
+
+    def _leaf_weights(self, X):
+        # (n_rows x n_leaves) matrix averaging the leaf each tree sends a row to
+        leaves = self.apply(X)
+        n_rows = leaves.shape[0]
+        data = np.full(leaves.size, 1 / self.n_trees, dtype=np.float32)
+        indptr = np.arange(0, leaves.size + 1, self.n_trees)
+        return sp.csr_matrix((data, leaves.ravel(), indptr), shape=(n_rows, len(self.leaf_survival)))
+
+    def predict_survival_function(self, X, return_array=True):
+        # Forest survival curve at unique_times_, shape (n_rows, n_times)
+        if not return_array:
+            raise ValueError("ForestEngine only returns survival curves as arrays")
+        return np.asarray(self._leaf_weights(X) @ self.leaf_survival, dtype=np.float64)
+
+    def predict_cumulative_hazard_function(self, X, return_array=True):
+        if not return_array:
+            raise ValueError("ForestEngine only returns cumulative hazard curves as arrays")
+        return np.asarray(self._leaf_weights(X) @ self.leaf_chf, dtype=np.float64)
+
+    def predict(self, X):
+        # Risk score, the cumulative hazard summed over the event times
+        return self._leaf_weights(X) @ self.leaf_risk
+
+    def predict_survival_at(self, X, days):
+        """Forest survival at each of days, shape (n_rows, len(days)), without building full curves."""
+        self.add_horizons(days)
+        survival = np.asarray(self._leaf_weights(X) @ self.horizon_survival, dtype=np.float64)
+        return survival[:, [self.horizons[d] for d in days]]
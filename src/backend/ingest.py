@@ -0,0 +1,175 @@
+import os
+
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+# Columns of the hospital export that the preprocessing pipeline uses
+VISIT_COLUMNS = [
+    'Patient ID',
+    'Admit/Visit Date/Time',
+    'Date of Birth',
+    'Gender',
+    'Death Date',
+    'Case Type Description',
+    'Primary Diagnosis Code (Mediclaim)',
+    'Secondary Diagnosis Code Concat (Mediclaim)',
+]
+DATE_COLUMNS = ['Admit/Visit Date/Time', 'Date of Birth', 'Death Date']
+TEXT_COLUMNS = [
+    'Patient ID',
+    'Gender',
+    'Case Type Description',
+    'Primary Diagnosis Code (Mediclaim)',
+    'Secondary Diagnosis Code Concat (Mediclaim)',
+]
+
+# Format of the text dates in exports, e.g. "%d/%m/%Y %H:%M". When unset it is
+# inferred per column from the first text value, like pd.to_datetime does.
+# Excel cells usually already hold dates.
+DATE_FORMAT = os.environ.get("EXPORT_DATE_FORMAT") or None
+# Share of the non-empty values of a date column that may fail to parse
+MAX_UNPARSED_DATES = 0.01
+CHUNKSIZE = 100_000
+
+
+def _check_columns(columns):
+    missing = [col for col in VISIT_COLUMNS if col not in columns]
+    if missing:
+        raise ValueError(f"File is missing required columns: {', '.join(missing)}")
+
+
+def _read_csv_chunks(file_path, chunksize):
+    header = pd.read_csv(file_path, nrows=0).columns
+    _check_columns(header)
+    yield from pd.read_csv(
+        file_path,
+        usecols=VISIT_COLUMNS,
+        dtype={col: str for col in TEXT_COLUMNS},
+        chunksize=chunksize,
+    )
+
+
+def _read_xlsx_chunks(file_path, chunksize):
+    from openpyxl import load_workbook
+
+    # Read-only mode streams rows instead of loading the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(value).strip() if value is not None else '' for value in next(rows, ())]
+        _check_columns(header)
+        positions = [header.index(col) for col in VISIT_COLUMNS]
+
+        chunk = []
+        for row in rows:
+            chunk.append([row[i] if i < len(row) else None for i in positions])
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=VISIT_COLUMNS)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=VISIT_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def _read_xls_chunks(file_path, chunksize):
+    # Legacy .xls has no streaming reader, read the used columns in one go
+    raw_df = pd.read_excel(file_path)
+    _check_columns(raw_df.columns)
+    yield raw_df[VISIT_COLUMNS]
+
+
+def read_chunks(file_path, chunksize=CHUNKSIZE):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".csv":
+        return _read_csv_chunks(file_path, chunksize)
+    if extension in (".xlsx", ".xlsm"):
+        return _read_xlsx_chunks(file_path, chunksize)
+    if extension == ".xls":
+        return _read_xls_chunks(file_path, chunksize)
+    raise ValueError(f"Unsupported file type: {extension}. Upload a CSV or XLSX file.")
+
+
+def read_visits(file_path, start_date, end_date, case_types, chunksize=CHUNKSIZE, date_format=DATE_FORMAT):
+    """Read the visits of a hospital export that fall in the study window.
+
+    Only VISIT_COLUMNS are read. Each chunk has its date columns parsed once
+    (time of day dropped, see DateParser) and is filtered on the admit date
+    window and case types before the next chunk is read, so memory follows
+    the filtered rows rather than the size of the export.
+    Returns the visits sorted by Patient ID and admit date; a ValueError if
+    too many dates could not be parsed.
+    """
+    dates = DateParser(date_format)
+    filtered_chunks = [
+        filter_chunk(chunk, start_date, end_date, case_types, dates) for chunk in read_chunks(file_path, chunksize)
+    ]
+    dates.check()
+    if not filtered_chunks:
+        return empty_visits()
+
+    visits = pd.concat(filtered_chunks, ignore_index=True)
+    return visits.sort_values(by=['Patient ID', 'Admit/Visit Date/Time'])
+
+
+class DateParser:
+    """Parses the date columns of every chunk of one export with the same formats.
+
+    Values that are not empty but cannot be parsed become NaT and are
+    counted, check() then fails the upload if a column has too many of them
+    instead of silently dropping those visits.
+    """
+
+    def __init__(self, date_format=DATE_FORMAT):
+        self.formats = {col: date_format for col in DATE_COLUMNS} if date_format else {}
+        self.values = {col: 0 for col in DATE_COLUMNS}
+        self.unparsed = {col: 0 for col in DATE_COLUMNS}
+        self.examples = {}
+
+    def _format(self, col, values):
+        if col not in self.formats:
+            text = values[values.map(lambda value: isinstance(value, str))]
+            if text.empty:
+                return None
+            # The first value a format can be guessed from, anything else is parsed value by value
+            guesses = (guess_datetime_format(value) for value in text.iloc[:100])
+            self.formats[col] = next((guess for guess in guesses if guess), "mixed")
+        return self.formats[col]
+
+    def parse(self, chunk):
+        for col in DATE_COLUMNS:
+            values = chunk[col]
+            present = values.notna() & (values.astype(str).str.strip() != '')
+            parsed = pd.to_datetime(values, format=self._format(col, values[present]), errors='coerce')
+            failed = present & parsed.isna()
+            self.values[col] += int(present.sum())
+            self.unparsed[col] += int(failed.sum())
+            if failed.any():
+                self.examples.setdefault(col, str(values[failed].iloc[0]))
+            chunk[col] = parsed.dt.normalize()
+        return chunk
+
+    def check(self, max_unparsed=MAX_UNPARSED_DATES):
+        for col in DATE_COLUMNS:
+            if self.unparsed[col] > max_unparsed * self.values[col]:
+                date_format = self.formats.get(col)
+                expected = "dates" if date_format in (None, "mixed") else f"dates in the format {date_format}"
+                raise ValueError(
+                    f"{self.unparsed[col]} of {self.values[col]} '{col}' values are not {expected}, "
+                    f"e.g. '{self.examples[col]}'. Use one date format per column or set EXPORT_DATE_FORMAT"
+                )
+
+
+def filter_chunk(chunk, start_date, end_date, case_types, dates=None):
+    # Parse the date columns of a chunk and keep its visits in the window and case types
+    (dates or DateParser()).parse(chunk)
+
+    admit = chunk['Admit/Visit Date/Time']
+    keep = (admit >= start_date) & (admit <= end_date) & chunk['Case Type Description'].isin(case_types)
+    return chunk[keep]
+
+
+def empty_visits():
+    return pd.DataFrame({
+        col: pd.Series(dtype='datetime64[ns]' if col in DATE_COLUMNS else object) for col in VISIT_COLUMNS
+    })
@@ -0,0 +1,220 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+JOBS_FOLDER = "jobs"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Job folders, with their copy of the upload, are deleted this long after the job finished
+JOB_RETENTION_DAYS = float(os.environ.get("JOB_RETENTION_DAYS", 7))
+# Expired jobs are looked for at most this often
+CLEANUP_INTERVAL_SECONDS = 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _write_json(path, data):
+    # Write next to the target and rename so readers never see half a file
+    temp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, default=str)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class Job:
+    """Handle passed to a running job for its workspace, progress and cancellation."""
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self.workspace = os.path.join(job_dir, "workspace")
+
+    def path(self, name):
+        return os.path.join(self.workspace, name)
+
+    def update(self, **fields):
+        status_path = os.path.join(self.job_dir, "status.json")
+        status = _read_json(status_path)
+        status.update(fields, updated=time.time())
+        _write_json(status_path, status)
+
+    def cancelled(self):
+        return os.path.exists(os.path.join(self.job_dir, "cancel"))
+
+    def stage(self, name, progress):
+        # Called at every stage boundary, the job stops here once cancel() was requested
+        if self.cancelled():
+            raise JobCancelled()
+        self.update(stage=name, progress=progress, stages=metrics.current_records())
+
+
+def _write_profile(job_dir, profiler):
+    # Raw stats for pstats/snakeviz and the top functions as text
+    profiler.dump_stats(os.path.join(job_dir, "profile.pstats"))
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+    with open(os.path.join(job_dir, "profile.txt"), "w") as f:
+        f.write(text.getvalue())
+
+
+def _run_job(job_dir, func, args, profile=False):
+    # Entry point in the worker process
+    job = Job(job_dir)
+    profiler = cProfile.Profile() if profile else None
+    with metrics.recording() as records:
+        try:
+            if job.cancelled():
+                raise JobCancelled()
+            job.update(state=RUNNING, started=time.time())
+            if profiler is not None:
+                result = profiler.runcall(func, job, *args)
+            else:
+                result = func(job, *args)
+            job.update(state=DONE, stage="done", progress=1.0, result=result, stages=records, finished=time.time())
+        except JobCancelled:
+            job.update(state=CANCELLED, stages=records, finished=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            job.update(state=FAILED, error=str(e), stages=records, finished=time.time())
+        finally:
+            if profiler is not None:
+                _write_profile(job_dir, profiler)
+
+
+class JobQueue:
+    """Runs jobs in a process pool, each job in its own folder under jobs/<job id>/.
+
+    status.json in the job folder holds the state, current stage, progress
+    (0 to 1), the timed stages and result of the job, and is the only thing
+    the web process reads back, so any number of uploads and trainings can
+    run side by side without sharing files. The stages of finished jobs are
+    added up in self.metrics.
+    """
+
+    def __init__(self, root=JOBS_FOLDER, max_workers=JOB_WORKERS):
+        self.root = root
+        self.max_workers = max_workers
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        self.metrics = metrics.StageMetrics()
+        self.last_cleanup = 0.0
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def create(self, kind, **info):
+        # Make the job folder before submitting, so request files can be saved into its workspace
+        self._cleanup()
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(os.path.join(job_dir, "workspace"))
+        _write_json(os.path.join(job_dir, "status.json"), dict(
+            info, id=job_id, kind=kind, state=QUEUED, stage="queued", progress=0.0,
+            result=None, error=None, created=time.time(), updated=time.time()
+        ))
+        return Job(job_dir)
+
+    def _cleanup(self):
+        with self.lock:
+            if time.time() - self.last_cleanup < CLEANUP_INTERVAL_SECONDS:
+                return
+            self.last_cleanup = time.time()
+        self.remove_expired()
+
+    def remove_expired(self, max_age_days=JOB_RETENTION_DAYS):
+        """Delete the folders of jobs that finished more than max_age_days ago.
+
+        Jobs whose worker died never finish, they expire max_age_days after
+        their last update unless this queue still runs them. Returns the
+        removed job ids.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        cutoff = time.time() - max_age_days * 86400
+        removed = []
+        for job_id in os.listdir(self.root):
+            future = self.futures.get(job_id)
+            if future is not None and not future.done():
+                continue
+            try:
+                status = self.status(job_id)
+            except (OSError, ValueError):
+                continue
+            if status is None or (status.get("finished") or status["updated"]) >= cutoff:
+                continue
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+            removed.append(job_id)
+        return removed
+
+    def submit(self, job, func, *args, profile=False):
+        # With profile the job runs under cProfile and writes profile.txt to its folder
+        with self.lock:
+            # The pool is started on first use, not when the module is imported
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            # Forget jobs that already finished, their status stays on disk
+            self.futures = {key: future for key, future in self.futures.items() if not future.done()}
+            job_id = os.path.basename(job.job_dir)
+            future = self.pool.submit(_run_job, job.job_dir, func, args, profile)
+            self.futures[job_id] = future
+        future.add_done_callback(lambda _: self._finished(job_id))
+        return job_id
+
+    def _finished(self, job_id):
+        status = self.status(job_id)
+        if status is not None:
+            self.metrics.observe_job(status)
+
+    def status(self, job_id):
+        status_path = os.path.join(self.job_dir(job_id), "status.json")
+        if not job_id.isalnum() or not os.path.exists(status_path):
+            return None
+        return _read_json(status_path)
+
+    def cancel(self, job_id):
+        status = self.status(job_id)
+        if status is None or status["state"] in FINISHED_STATES:
+            return status
+
+        # Running jobs see the marker at their next stage, queued jobs never start
+        open(os.path.join(self.job_dir(job_id), "cancel"), "w").close()
+        future = self.futures.get(job_id)
+        if future is not None and future.cancel():
+            Job(self.job_dir(job_id)).update(state=CANCELLED, finished=time.time())
+        return self.status(job_id)
+
+    def profile(self, job_id):
+        profile_path = os.path.join(self.job_dir(job_id), "profile.txt")
+        if not job_id.isalnum() or not os.path.exists(profile_path):
+            return None
+        with open(profile_path) as f:
+            return f.read()
+
+    def wait(self, job_id):
+        future = self.futures.get(job_id)
+        if future is not None:
+            future.result()
+        return self.status(job_id)
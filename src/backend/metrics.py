@@ -0,0 +1,112 @@
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Stage records of the job running in this process, None outside recording()
+_records = None
+
+
+def current_rss():
+    # Resident set size in bytes, from /proc where available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Time a named pipeline stage.
+
+    Yields the record dict, so the caller can set "rows" once it knows the
+    row count. Duration and RSS change are filled in when the block exits and
+    the record is kept if recording() is active.
+    """
+    record = {"stage": name, "rows": rows}
+    start_rss = current_rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_s"] = round(time.perf_counter() - start, 6)
+        record["memory_delta_bytes"] = current_rss() - start_rss
+        print(f"{name}: {record['duration_s']:.3f} s, {record['rows']} rows, {record['memory_delta_bytes'] / 2**20:+.1f} MB")
+        if _records is not None:
+            _records.append(record)
+
+
+@contextmanager
+def recording():
+    # Collect the records of every stage run inside the block
+    global _records
+    previous = _records
+    _records = []
+    try:
+        yield _records
+    finally:
+        _records = previous
+
+
+def current_records():
+    return list(_records or [])
+
+
+def add_records(records):
+    # Stages timed in another process, e.g. a pool worker
+    if _records is not None:
+        _records.extend(records)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{str(value)}"' for key, value in labels.items())
+
+
+class StageMetrics:
+    """Totals over finished jobs, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.counts = {}
+        self.rows = {}
+        self.last_duration = {}
+        self.last_memory_delta = {}
+        self.jobs = {}
+
+    def observe_job(self, status):
+        with self.lock:
+            key = (status.get("kind"), status.get("state"))
+            self.jobs[key] = self.jobs.get(key, 0) + 1
+            for record in status.get("stages") or []:
+                name = record["stage"]
+                self.durations[name] = self.durations.get(name, 0.0) + record["duration_s"]
+                self.counts[name] = self.counts.get(name, 0) + 1
+                self.rows[name] = self.rows.get(name, 0) + (record.get("rows") or 0)
+                self.last_duration[name] = record["duration_s"]
+                self.last_memory_delta[name] = record["memory_delta_bytes"]
+
+    def render(self):
+        with self.lock:
+            lines = [
+                "# HELP cgh_jobs_total Finished jobs by kind and final state.",
+                "# TYPE cgh_jobs_total counter",
+            ]
+            lines += [f"cgh_jobs_total{{{_labels(kind=kind, state=state)}}} {count}" for (kind, state), count in sorted(self.jobs.items())]
+            metrics = [
+                ("cgh_stage_duration_seconds", "summary", "Time spent in each pipeline stage.", None),
+                ("cgh_stage_rows_total", "counter", "Rows processed by each pipeline stage.", self.rows),
+                ("cgh_stage_last_duration_seconds", "gauge", "Duration of the latest run of each stage.", self.last_duration),
+                ("cgh_stage_last_memory_delta_bytes", "gauge", "RSS change over the latest run of each stage.", self.last_memory_delta),
+            ]
+            for name, kind, description, values in metrics:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                if values is None:
+                    for stage_name in sorted(self.durations):
+                        lines.append(f"{name}_sum{{{_labels(stage=stage_name)}}} {self.durations[stage_name]}")
+                        lines.append(f"{name}_count{{{_labels(stage=stage_name)}}} {self.counts[stage_name]}")
+                else:
+                    lines += [f"{name}{{{_labels(stage=stage_name)}}} {value}" for stage_name, value in sorted(values.items())]
+            return "\n".join(lines) + "\n"
@@ -0,0 +1,46 @@
+"""Convert models stored as pickles in the models table to the artifact format.
+
+Usage: python migrate_models.py [--dry-run]
+
+Rows already holding an artifact are skipped, so the script can be run again
+safely. Each row is converted and committed on its own.
+"""
+import argparse
+import pickle
+
+import db
+import model_artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert pickled models to the model artifact format")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the size of each converted model")
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        migrate(conn, args.dry_run)
+
+
+def migrate(conn, dry_run):
+    cur = conn.cursor()
+
+    # Fetch the ids first so only one model is held in memory at a time
+    cur.execute("SELECT modelid, c_index FROM models ORDER BY modelid")
+    rows = cur.fetchall()
+
+    for modelid, c_index in rows:
+        model_data = db.read_model(conn, modelid)
+        if model_data is None or model_artifact.is_artifact(model_data):
+            print(f"Model {modelid}: already an artifact")
+            continue
+
+        rsf = pickle.loads(model_data)
+        artifact = model_artifact.dumps(rsf, c_index=None if c_index is None else float(c_index))
+        print(f"Model {modelid}: {len(model_data) / 1e6:.1f} MB pickle -> {len(artifact) / 1e6:.1f} MB artifact")
+        if not dry_run:
+            db.update_model_data(conn, modelid, artifact)
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
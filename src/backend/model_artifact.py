@@ -0,0 +1,184 @@
+import json
+import struct
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+# File layout:
+#   MAGIC | version, flags, header length (struct "<HHI") | JSON header | padding | body
+# The body holds the arrays listed in header["arrays"] at 64-byte aligned offsets.
+# With FLAG_DEFLATE the body is zlib-compressed (used for the models table),
+# without it the body is stored raw so a local copy can be memory-mapped.
+MAGIC = b"CGHRSF\x00\x01"
+FORMAT_VERSION = 1
+FLAG_DEFLATE = 1
+PREFIX = struct.Struct("<HHI")
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def is_artifact(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def _json_value(value):
+    # Model parameters are plain Python values, except numpy scalars
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def forest_arrays(rsf):
+    """Flatten the trees of a fitted RandomSurvivalForest into contiguous arrays.
+
+    Node arrays are concatenated over all trees and children are indices
+    within their own tree (tree_offsets[i] is the first node of tree i).
+    Only leaves keep a curve: leaf_index maps a node to its row in
+    leaf_chf / leaf_survival, or -1 for split nodes.
+    """
+    node_counts = [est.tree_.node_count for est in rsf.estimators_]
+    tree_offsets = np.concatenate([[0], np.cumsum(node_counts)]).astype(np.int64)
+
+    states = [est.tree_.__getstate__() for est in rsf.estimators_]
+    nodes = np.concatenate([state["nodes"] for state in states])
+    is_leaf = nodes["left_child"] == -1
+    leaf_index = np.full(len(nodes), -1, dtype=np.int32)
+    leaf_index[is_leaf] = np.arange(is_leaf.sum(), dtype=np.int32)
+
+    values = [state["values"][state["nodes"]["left_child"] == -1] for state in states]
+    leaf_chf = np.concatenate([value[:, :, 0] for value in values]).astype(np.float32)
+    leaf_survival = np.concatenate([value[:, :, 1] for value in values]).astype(np.float32)
+
+    return {
+        "tree_offsets": tree_offsets,
+        "max_depth": np.array([state["max_depth"] for state in states], dtype=np.int32),
+        "random_state": np.array([est.random_state for est in rsf.estimators_], dtype=np.int64),
+        "children_left": nodes["left_child"].astype(np.int32),
+        "children_right": nodes["right_child"].astype(np.int32),
+        "feature": nodes["feature"].astype(np.int32),
+        # Thresholds stay float64, rounding them could send a row down the other branch
+        "threshold": nodes["threshold"],
+        "missing_go_to_left": nodes["missing_go_to_left"],
+        "leaf_index": leaf_index,
+        "leaf_chf": leaf_chf,
+        "leaf_survival": leaf_survival,
+    }
+
+
+def forest_header(rsf, **metadata):
+    feature_names = getattr(rsf, "feature_names_in_", None)
+    return dict(
+        metadata,
+        format_version=FORMAT_VERSION,
+        model_type=type(rsf).__name__,
+        created=metadata.get("created", datetime.now().isoformat()),
+        params={key: _json_value(value) for key, value in rsf.get_params(deep=False).items()},
+        n_features=int(rsf.n_features_in_),
+        feature_names=None if feature_names is None else [str(name) for name in feature_names],
+        n_estimators=len(rsf.estimators_),
+        max_features=int(rsf.estimators_[0].max_features_),
+        unique_times=rsf.unique_times_.tolist(),
+        is_event_time=rsf.is_event_time_.tolist(),
+    )
+
+
+def dumps(rsf, compress=True, **metadata):
+    """Serialize a fitted RandomSurvivalForest into the artifact format.
+
+    metadata (for example c_index, or codes: the diagnosis code columns
+    predict.py fills from the selected codes) is stored in the header next
+    to the feature order and time grid, where read_header finds it without
+    touching the trees.
+    """
+    arrays = forest_arrays(rsf)
+    header = forest_header(rsf, **metadata)
+
+    # Lay the arrays out one after another at aligned offsets
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        table[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    body = bytearray(offset)
+    for name, array in arrays.items():
+        start = table[name]["offset"]
+        body[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    header["arrays"] = table
+    return pack(header, bytes(body), compress)
+
+
+def pack(header, body, compress):
+    header_bytes = json.dumps(header).encode()
+    flags = FLAG_DEFLATE if compress else 0
+    prefix = MAGIC + PREFIX.pack(FORMAT_VERSION, flags, len(header_bytes)) + header_bytes
+    if compress:
+        return prefix + zlib.compress(body, 6)
+    # Raw bodies start on an aligned file offset so np.memmap can map each array directly
+    return prefix + b"\x00" * (_align(len(prefix)) - len(prefix)) + body
+
+
+def _parse_prefix(data):
+    if not is_artifact(data):
+        raise ValueError("Not a model artifact")
+    version, flags, header_length = PREFIX.unpack_from(data, len(MAGIC))
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Model artifact version {version} is newer than supported version {FORMAT_VERSION}")
+    header_start = len(MAGIC) + PREFIX.size
+    header = json.loads(bytes(data[header_start:header_start + header_length]))
+    return header, flags, header_start + header_length
+
+
+def read_header(path):
+    # Only the prefix and JSON header are read from disk
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + PREFIX.size)
+        if not is_artifact(prefix):
+            raise ValueError("Not a model artifact")
+        header_length = PREFIX.unpack_from(prefix, len(MAGIC))[2]
+        return _parse_prefix(prefix + f.read(header_length))[0]
+
+
+def loads(data):
+    """Return (header, arrays) from artifact bytes, inflating a compressed body."""
+    header, flags, body_start = _parse_prefix(data)
+    if flags & FLAG_DEFLATE:
+        body = zlib.decompress(data[body_start:])
+    else:
+        body = memoryview(data)[_align(body_start):]
+    return header, _arrays(header, body)
+
+
+def load(path, mmap=True):
+    """Return (header, arrays) from an artifact file.
+
+    Raw artifacts are memory-mapped, so only the pages that are used get read.
+    """
+    if not mmap:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    header, flags, body_start = _parse_prefix(data)
+    if flags & FLAG_DEFLATE:
+        return header, _arrays(header, zlib.decompress(data[body_start:]))
+    return header, _arrays(header, data[_align(body_start):])
+
+
+def _arrays(header, body):
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = np.frombuffer(body, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+    return arrays
+
+
+def inflate(data):
+    # Compressed artifact bytes to the raw, memory-mappable form
+    header, flags, body_start = _parse_prefix(data)
+    if not flags & FLAG_DEFLATE:
+        return bytes(data)
+    return pack(header, zlib.decompress(data[body_start:]), compress=False)
+
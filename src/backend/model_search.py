@@ -0,0 +1,137 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler
+
+# Hyperparameters tried by the search, the current defaults are included
+SEARCH_SPACE = {
+    "n_estimators": [50, 100, 200],
+    "min_samples_split": [5, 10, 20],
+    "min_samples_leaf": [5, 15, 30],
+    "max_features": ["sqrt", 0.5],
+}
+SEARCH_FOLDS = 5
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))
+
+# A configuration stops once its mean fold score is this far below the best mean
+EARLY_STOP_MARGIN = 0.02
+# Folds every configuration gets before it can be stopped
+MIN_FOLDS = 2
+
+
+def candidate_groups(space=SEARCH_SPACE, n_iter=None, random_state=42):
+    """Candidate configurations grouped by everything except n_estimators.
+
+    The whole grid is used by default, or n_iter random draws of it. Within a
+    group the forest is grown by warm start, so e.g. 50, 100 and 200 trees
+    cost one 200-tree fit. Returns a list of (params, sorted n_estimators).
+    """
+    if n_iter is None:
+        candidates = list(ParameterGrid(space))
+    else:
+        candidates = list(ParameterSampler(space, n_iter=n_iter, random_state=random_state))
+
+    groups = {}
+    for params in candidates:
+        params = dict(params)
+        n_estimators = params.pop("n_estimators", 100)
+        groups.setdefault(tuple(sorted(params.items(), key=lambda item: item[0])), set()).add(n_estimators)
+    return [(dict(key), sorted(n_estimators)) for key, n_estimators in groups.items()]
+
+
+def write_folds(work_dir, X, y, folds, random_state=42):
+    # Each fold's train and test rows are written once as .npy files, which every
+    # worker memory-maps, so all candidate fits read the same pages
+    X = X.toarray() if sp.issparse(X) else np.asarray(X)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    splits = KFold(n_splits=folds, shuffle=True, random_state=random_state).split(X)
+    for fold, (train_index, test_index) in enumerate(splits):
+        np.save(os.path.join(work_dir, f"X_train_{fold}.npy"), X[train_index])
+        np.save(os.path.join(work_dir, f"y_train_{fold}.npy"), y[train_index])
+        np.save(os.path.join(work_dir, f"X_test_{fold}.npy"), X[test_index])
+        np.save(os.path.join(work_dir, f"y_test_{fold}.npy"), y[test_index])
+
+
+def _load_fold(work_dir, fold, part):
+    X = np.load(os.path.join(work_dir, f"X_{part}_{fold}.npy"), mmap_mode="r")
+    y = np.load(os.path.join(work_dir, f"y_{part}_{fold}.npy"), mmap_mode="r")
+    return X, np.asarray(y)
+
+
+def fit_fold(work_dir, fold, params, n_estimators, random_state=42):
+    """Concordance on one fold for each tree count of a candidate group, in worker processes."""
+    from sksurv.ensemble import RandomSurvivalForest
+
+    X_train, y_train = _load_fold(work_dir, fold, "train")
+    X_test, y_test = _load_fold(work_dir, fold, "test")
+
+    # One thread per fit, the search runs many fits side by side
+    rsf = RandomSurvivalForest(n_estimators=n_estimators[0], warm_start=True, n_jobs=1, random_state=random_state, **params)
+    scores = {}
+    for count in n_estimators:
+        rsf.set_params(n_estimators=count)
+        rsf.fit(X_train, y_train)
+        scores[count] = float(rsf.score(X_test, y_test))
+    return scores
+
+
+def search_forest(X, y, space=SEARCH_SPACE, folds=SEARCH_FOLDS, n_iter=None, workers=SEARCH_WORKERS,
+                  random_state=42, margin=EARLY_STOP_MARGIN, min_folds=MIN_FOLDS, progress=None):
+    """K-fold cross-validated search for RandomSurvivalForest hyperparameters.
+
+    Folds are evaluated in rounds: every remaining candidate group is fitted
+    on fold k in the process pool, then groups whose mean score is more than
+    margin below the best mean are dropped. progress(fraction) is called
+    after every round.
+
+    Returns a dict with the best params (n_estimators included), its mean
+    concordance, its fold scores, and the scores of every configuration tried.
+    """
+    groups = candidate_groups(space, n_iter, random_state)
+    scores = {i: {count: [] for count in n_estimators} for i, (_, n_estimators) in enumerate(groups)}
+    remaining = list(range(len(groups)))
+
+    def mean_scores(i):
+        return {count: float(np.mean(fold_scores)) for count, fold_scores in scores[i].items()}
+
+    with tempfile.TemporaryDirectory(prefix="rsf_search_") as work_dir:
+        write_folds(work_dir, X, y, folds, random_state)
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as pool:
+            for fold in range(folds):
+                futures = {
+                    i: pool.submit(fit_fold, work_dir, fold, groups[i][0], groups[i][1], random_state)
+                    for i in remaining
+                }
+                for i, future in futures.items():
+                    for count, score in future.result().items():
+                        scores[i][count].append(score)
+
+                # Stop the groups that are clearly losing
+                best = {i: max(mean_scores(i).values()) for i in remaining}
+                if fold + 1 >= min_folds and fold + 1 < folds:
+                    top = max(best.values())
+                    remaining = [i for i in remaining if best[i] >= top - margin]
+                if progress is not None:
+                    progress((fold + 1) / folds)
+
+    # Only configurations evaluated on every fold can win
+    results = []
+    for i, (params, n_estimators) in enumerate(groups):
+        for count in n_estimators:
+            results.append({
+                "params": dict(params, n_estimators=count),
+                "fold_scores": scores[i][count],
+                "mean_score": float(np.mean(scores[i][count])),
+                "complete": len(scores[i][count]) == folds,
+            })
+    best_result = max((result for result in results if result["complete"]), key=lambda result: result["mean_score"])
+    return {
+        "best_params": best_result["params"],
+        "best_score": best_result["mean_score"],
+        "fold_scores": best_result["fold_scores"],
+        "folds": folds,
+        "results": results,
+    }
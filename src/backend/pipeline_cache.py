@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+CACHE_FOLDER = "cache"
+
+# Bump when a pipeline change makes earlier cached results invalid
+PIPELINE_VERSION = 5
+
+# Replaced versions are deleted once they are this old, readers have long finished with them
+STALE_VERSION_SECONDS = 300
+
+# Cached stages that were not saved or loaded for this long are evicted
+CACHE_RETENTION_DAYS = float(os.environ.get("CACHE_RETENTION_DAYS", 14))
+
+
+def file_digest(file_path, block_size=1 << 20):
+    # SHA-256 of the file contents, read in blocks
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_digest(**params):
+    # Stable hash of the pipeline parameters
+    payload = json.dumps({"version": PIPELINE_VERSION, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def visit_hashes(visits, patient_col='Patient ID'):
+    """One hash per patient over all of that patient's visit rows.
+
+    The row position within the patient is part of the hash, so reordering
+    same-day visits counts as a change just like an added or edited visit.
+    """
+    position = visits.groupby(patient_col, sort=False).cumcount()
+    row_hashes = pd.util.hash_pandas_object(visits.assign(_position=position), index=False)
+    # Wrapping uint64 sum per patient
+    return row_hashes.groupby(visits[patient_col].to_numpy()).sum()
+
+
+def swap_in(final_path, write):
+    """Write a new version of the folder final_path and make it current in one step.
+
+    write(folder) fills a new, uniquely named sibling folder, then final_path
+    is pointed at it by replacing a symlink, which is atomic. Concurrent
+    writers never touch each other's folders, the last swap wins, and readers
+    that resolve final_path once see one whole version. Replaced versions are
+    deleted after STALE_VERSION_SECONDS.
+    """
+    parent, name = os.path.split(final_path)
+    os.makedirs(parent or ".", exist_ok=True)
+    version = f"{name}.v{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    version_path = os.path.join(parent, version)
+    os.makedirs(version_path)
+    write(version_path)
+
+    link_path = os.path.join(parent, f"{name}.link-{uuid.uuid4().hex}")
+    os.symlink(version, link_path)
+    if os.path.isdir(final_path) and not os.path.islink(final_path):
+        # A folder written before versions were used
+        shutil.rmtree(final_path, ignore_errors=True)
+    os.replace(link_path, final_path)
+    _remove_stale_versions(parent, name)
+    return final_path
+
+
+def _remove_stale_versions(parent, name):
+    current = os.readlink(os.path.join(parent, name))
+    cutoff = time.time() - STALE_VERSION_SECONDS
+    for entry in os.listdir(parent or "."):
+        if not entry.startswith(f"{name}.v") or entry == current:
+            continue
+        entry_path = os.path.join(parent, entry)
+        try:
+            if os.lstat(entry_path).st_mtime < cutoff:
+                shutil.rmtree(entry_path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+class StageCache:
+    """Stage results stored on disk under cache/<stage>/<key>/.
+
+    Each key is a symlink to its current version, see swap_in.
+    """
+
+    def __init__(self, root=CACHE_FOLDER):
+        self.root = root
+
+    def path(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def has(self, stage, key):
+        return os.path.islink(self.path(stage, key))
+
+    def load_frame(self, stage, key, name="frame"):
+        return self.load_frames(stage, key, name)[0]
+
+    def _touch(self, stage, key):
+        # The link's own mtime is the last use of the entry, see evict
+        try:
+            os.utime(self.path(stage, key), follow_symlinks=False)
+        except FileNotFoundError:
+            pass
+
+    def load_frames(self, stage, key, *names):
+        # All frames come from the same version, even while another job saves a new one
+        if not self.has(stage, key):
+            return [None] * len(names)
+        self._touch(stage, key)
+        version_path = os.path.realpath(self.path(stage, key))
+        frames = []
+        for name in names:
+            file_path = os.path.join(version_path, f"{name}.pkl")
+            frames.append(pd.read_pickle(file_path) if os.path.exists(file_path) else None)
+        return frames
+
+    def save_frames(self, stage, key, **frames):
+        def write(version_path):
+            for name, frame in frames.items():
+                frame.to_pickle(os.path.join(version_path, f"{name}.pkl"))
+        swap_in(self.path(stage, key), write)
+
+    def save_files(self, stage, key, *file_paths, names=None):
+        # names optionally gives the name each file (or folder) is stored under
+        def write(version_path):
+            for file_path, name in zip(file_paths, names or [None] * len(file_paths)):
+                target = os.path.join(version_path, name or os.path.basename(file_path))
+                if os.path.isdir(file_path):
+                    shutil.copytree(file_path, target)
+                else:
+                    shutil.copy(file_path, target)
+        swap_in(self.path(stage, key), write)
+
+    def file(self, stage, key, name):
+        # Inside the current version, so the file stays whole while it is copied
+        self._touch(stage, key)
+        return os.path.join(os.path.realpath(self.path(stage, key)), name)
+
+    def evict(self, max_age_days=CACHE_RETENTION_DAYS):
+        """Delete the entries that were not saved or loaded for max_age_days.
+
+        An expired entry loses its link first. Its version folder is dated
+        now and deleted by a later call once it is STALE_VERSION_SECONDS old,
+        so a job that resolved the link just before keeps reading it.
+        Returns the number of entries evicted.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        evicted = 0
+        for stage in os.listdir(self.root):
+            stage_path = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_path) or os.path.islink(stage_path):
+                continue
+            for entry in os.listdir(stage_path):
+                entry_path = os.path.join(stage_path, entry)
+                try:
+                    if os.lstat(entry_path).st_mtime >= now - max_age_days * 86400 or ".link-" in entry:
+                        continue
+                    if not os.path.islink(entry_path):
+                        if ".v" not in entry:
+                            # An entry written before versions were used
+                            shutil.rmtree(entry_path, ignore_errors=True)
+                            evicted += 1
+                        continue
+                    version_path = os.path.realpath(entry_path)
+                    os.unlink(entry_path)
+                    os.utime(version_path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+
+            # Versions no entry points at any more, replaced or evicted
+            current = {os.readlink(os.path.join(stage_path, entry)) for entry in os.listdir(stage_path)
+                       if os.path.islink(os.path.join(stage_path, entry))}
+            for entry in os.listdir(stage_path):
+                entry_path = os.path.join(stage_path, entry)
+                if ".v" not in entry or entry in current or os.path.islink(entry_path):
+                    continue
+                try:
+                    if os.lstat(entry_path).st_mtime < now - STALE_VERSION_SECONDS:
+                        shutil.rmtree(entry_path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+        return evicted
+
+
+def incremental_patient_features(cache, key, visits, compute, patient_col='Patient ID'):
+    """Per-patient feature table, recomputing only patients whose visits changed.
+
+    The table and visit hashes of the previous run with the same parameters
+    are kept under the "patients" stage. Patients with an unchanged hash reuse
+    their cached row (or stay excluded), every other patient is passed to
+    compute(visits) and the results are merged. Returns (table, n_recomputed).
+    """
+    hashes = visit_hashes(visits, patient_col)
+
+    previous_hashes, previous_table = cache.load_frames("patients", key, "hashes", "table")
+    if previous_hashes is None or previous_table is None:
+        changed = hashes.index
+        reused = None
+    else:
+        common = hashes.index.intersection(previous_hashes.index)
+        unchanged = common[previous_hashes[common].to_numpy() == hashes[common].to_numpy()]
+        changed = hashes.index.difference(unchanged)
+        reused = previous_table[previous_table[patient_col].isin(unchanged)]
+
+    if len(changed) == 0:
+        # Nothing changed, the cached table is reused as is
+        table = reused
+    else:
+        recomputed = compute(visits[visits[patient_col].isin(changed)])
+        parts = [part for part in (reused, recomputed) if part is not None and len(part) > 0]
+        table = pd.concat(parts, ignore_index=True) if parts else recomputed
+    table = table.sort_values(patient_col, kind='mergesort').reset_index(drop=True)
+
+    cache.save_frames("patients", key, hashes=hashes, table=table)
+    return table, len(changed)
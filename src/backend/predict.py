@@ -1,47 +1,99 @@
 import sys
-import pickle
+import os
+import argparse
 import json
 import numpy as np
-from sksurv.ensemble import RandomSurvivalForest
-
-# Load model from file
-try:
-    with open(sys.argv[1], 'rb') as f:
-        model = pickle.load(f)
-except Exception as e:
-    print(json.dumps({"error": f"Model loading failed: {str(e)}"}))
-    sys.exit(1)
-
-# Process input parameters
-try:
-    gender = int(sys.argv[2])
-    age = int(sys.argv[3])
-    readmissions = int(sys.argv[4])
-    diagnostic_codes = sys.argv[5].split(',')
-    
-    diagnostic_codes = [int(code) for code in diagnostic_codes]
-
-    # Combine all features
-    features = [gender, age, readmissions] + diagnostic_codes
-    input_data = np.array([features])
+import pandas as pd
+from feature_matrix import load_features, feature_matrix
+from forest_engine import ForestEngine
+from cox_predictor import CoxPredictor
 
+# Days at which the dashboard reports survival and readmission figures
+HORIZONS = {
+    "survival_6_month": 180,
+    "survival_12_month": 360,
+    "readmission_1_year": 365,
+    "readmission_5_year": 1825,
+}
+
+
+# "forest" scores the random survival forest, "cox" the Cox predictor stored next to it
+PREDICTION_MODES = ("forest", "cox")
+
+
+def load_model(model_path, mode="forest"):
+    # Load a model artifact (or a model pickled before the artifact format) into the NumPy forest engine,
+    # or only its header for the Cox fast path
+    if mode == "cox":
+        return CoxPredictor.load(model_path)
+    if mode != "forest":
+        raise ValueError(f"Unknown prediction mode: {mode}")
+    return ForestEngine.load(model_path, horizons=list(HORIZONS.values()))
+
+
+def readmission_flag(readmissions):
+    # The dashboard sends a count, the Readmission feature was trained as a 0/1 flag
+    return int(int(readmissions) > 0)
+
+
+# Model features filled from the dashboard inputs, by feature name: (input, conversion)
+PATIENT_INPUTS = {"Gender": ("gender", int), "Age": ("age", int), "Readmission": ("readmissions", readmission_flag)}
+
+# Features that are not diagnosis codes, for models saved before the code list was stored with them
+NON_CODE_FEATURES = {
+    "Patient ID", "Dead", "Survival Duration (Days)", "Gender", "Age", "Readmission",
+    "Death in 6 Months", "Death in 12 Months", "Readmission in 6 Months", "Readmission in 12 Months",
+    "Readmission Count in 6 Months", "Readmission Count in 12 Months",
+}
+
+
+def model_codes(model):
+    # The diagnosis codes the model was trained on, in column order
+    if model.codes is not None:
+        return list(model.codes)
+    return [name for name in model.feature_index if name not in NON_CODE_FEATURES]
+
+
+def build_features(model, gender, age, readmissions, diagnostic_codes):
+    """One input row in the model's own column order.
+
+    diagnostic_codes lists the selected codes only; every column is found by
+    name, so the row does not depend on the order of the diagnostic_codes
+    table. Selected codes the model does not know are ignored and features
+    without a dashboard input are left at 0.
+    """
+    if not model.feature_index:
+        raise ValueError("Model has no stored feature names, retrain it to predict from selected codes")
+    input_data = np.zeros((1, model.n_features_in_), dtype=np.float32)
+    values = {"gender": gender, "age": age, "readmissions": readmissions}
+    for column, (name, convert) in PATIENT_INPUTS.items():
+        if column in model.feature_index:
+            input_data[0, model.feature_index[column]] = convert(values[name])
+    codes = set(model_codes(model))
+    for code in diagnostic_codes:
+        if code in codes:
+            input_data[0, model.feature_index[code]] = 1
+    return input_data
+
+
+def predict_patient(model, input_data):
     # Predict survival function
-    survival_funcs = model.predict_survival_function(input_data)
-    
+    survival_probs = model.predict_survival_function(input_data, return_array=True)
+
     # Convert survival function to lists
-    time_points = survival_funcs[0].x.tolist()
-    survival_probs = survival_funcs[0].y.tolist()
+    time_points = model.unique_times_.tolist()
+    survival_probs_list = survival_probs[0].tolist()
 
     # Survival and readmission probabilities at 6 months, 12 months, 1 year, 5 year
-    survival_6_month = float(survival_funcs[0](180))
-    survival_12_month = float(survival_funcs[0](360))  
-    readmission_1_year = 1 - float(survival_funcs[0](365))
-    readmission_5_year = 1 - float(survival_funcs[0](1825))
+    survival_6_month = float(survival_at(model.unique_times_, survival_probs, 180)[0])
+    survival_12_month = float(survival_at(model.unique_times_, survival_probs, 360)[0])
+    readmission_1_year = 1 - float(survival_at(model.unique_times_, survival_probs, 365)[0])
+    readmission_5_year = 1 - float(survival_at(model.unique_times_, survival_probs, 1825)[0])
 
-    response_data = {
+    return {
     "survival_curve": {
             "time": time_points,
-            "probability": survival_probs
+            "probability": survival_probs_list
         },
     "survival_6_month": survival_6_month,
     "survival_12_month": survival_12_month,
@@ -49,8 +101,115 @@ try:
     "readmission_5_year": readmission_5_year
     }
 
-    print(json.dumps(response_data))  # Print JSON output
 
-except Exception as e:
-    print(json.dumps({"error": str(e)}))
-    sys.exit(1)
\ No newline at end of file
+def survival_at(time_points, survival_probs, days):
+    # Same lookup as sksurv's StepFunction, for a whole (n_patients, n_times) array at once.
+    # Days after the last time point take the last value instead of raising.
+    index = np.searchsorted(time_points, days, side="right") - 1
+    return survival_probs[:, max(index, 0)]
+
+
+def read_table_chunks(input_path, chunksize):
+    # Stream patients from CSV, Parquet or JSON-lines without loading the whole file
+    extension = os.path.splitext(input_path)[1].lower()
+    if extension == ".csv":
+        yield from pd.read_csv(input_path, chunksize=chunksize)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif extension in (".jsonl", ".json"):
+        yield from pd.read_json(input_path, lines=True, chunksize=chunksize)
+    else:
+        raise ValueError(f"Unsupported input format: {extension}")
+
+
+def read_chunks(input_path, chunksize, feature_columns):
+    # Yields (patient ids, model input) per chunk, in the model's feature order
+    if os.path.isdir(input_path) or os.path.splitext(input_path)[1].lower() == ".npz":
+        # Features written by /fileUpload, scored straight from the sparse code matrix
+        frame, matrix, codes = load_features(input_path)
+        input_data = feature_matrix(frame, matrix, codes, feature_columns)
+        for start in range(0, input_data.shape[0], chunksize):
+            yield frame["Patient ID"].iloc[start:start + chunksize], input_data[start:start + chunksize]
+        return
+
+    for chunk in read_table_chunks(input_path, chunksize):
+        missing = [col for col in feature_columns if col not in chunk.columns]
+        if missing:
+            raise ValueError(f"Input is missing feature columns: {missing}")
+        patient_ids = chunk["Patient ID"] if "Patient ID" in chunk.columns else None
+        yield patient_ids, chunk[feature_columns].to_numpy(dtype=np.float32)
+
+
+def score_chunk(model, patient_ids, input_data):
+    # One forest evaluation for the whole chunk, only at the horizon days
+    survival_probs = model.predict_survival_at(input_data, list(HORIZONS.values()))
+
+    scores = pd.DataFrame()
+    if patient_ids is not None:
+        scores["Patient ID"] = np.asarray(patient_ids)
+    for i, (name, days) in enumerate(HORIZONS.items()):
+        probability = survival_probs[:, i]
+        scores[name] = 1 - probability if name.startswith("readmission") else probability
+    return scores
+
+
+def predict_batch(model, input_path, output_path, chunksize=1000):
+    # Score a whole cohort chunk by chunk, appending each chunk to the output
+    # so memory stays bounded by the chunk size
+    feature_columns = list(model.feature_names_in_)
+    as_json_lines = os.path.splitext(output_path)[1].lower() in (".jsonl", ".json")
+
+    n_scored = 0
+    with open(output_path, "w", newline="") as output:
+        for patient_ids, input_data in read_chunks(input_path, chunksize, feature_columns):
+            scores = score_chunk(model, patient_ids, input_data)
+            if as_json_lines:
+                scores.to_json(output, orient="records", lines=True)
+            else:
+                scores.to_csv(output, index=False, header=n_scored == 0)
+            n_scored += len(scores)
+    return n_scored
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(description="Score a cohort file with a trained model.")
+    parser.add_argument("model_path")
+    parser.add_argument("input_path", help="CSV, Parquet, JSON-lines file or processed_features folder with one row per patient")
+    parser.add_argument("output_path", help="CSV or JSON-lines file to write the scores to")
+    parser.add_argument("--chunksize", type=int, default=1000)
+    parser.add_argument("--mode", choices=PREDICTION_MODES, default="forest")
+    args = parser.parse_args(argv)
+
+    model = load_model(args.model_path, args.mode)
+    n_scored = predict_batch(model, args.input_path, args.output_path, args.chunksize)
+    print(json.dumps({"scored": n_scored, "output": args.output_path}))
+
+
+if __name__ == "__main__":
+    # Batch mode: python predict.py --batch model_file patients.csv scores.csv
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+
+    # Load model from file
+    try:
+        model = load_model(sys.argv[1])
+    except Exception as e:
+        print(json.dumps({"error": f"Model loading failed: {str(e)}"}))
+        sys.exit(1)
+
+    # Process input parameters
+    try:
+        # The selected diagnosis codes, comma-separated
+        diagnostic_codes = [code for code in sys.argv[5].split(',') if code] if len(sys.argv) > 5 else []
+        input_data = build_features(model, sys.argv[2], sys.argv[3], sys.argv[4], diagnostic_codes)
+
+        response_data = predict_patient(model, input_data)
+
+        print(json.dumps(response_data))  # Print JSON output
+
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
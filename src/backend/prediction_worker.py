@@ -0,0 +1,147 @@
+"""Long-lived prediction worker for the dashboard server.
+
+Reads one JSON request per line on stdin and writes one JSON response per line
+on stdout, so the Python process starts and each model is loaded only once
+instead of on every /predict call.
+
+Request:  {"id": 1, "modelid": 7, "model_path": "model_store/7-<sha256>.model",
+           "gender": 1, "age": 70, "readmissions": 2, "diagnostic_codes": ["E11", "I50"]}
+Response: {"id": 1, "result": {...}} or {"id": 1, "error": "...", "code": "..."}
+
+"model_path" is only needed the first time a modelid is seen (or after it was
+evicted); the dashboard server retries with the path when it gets back
+"model_not_loaded". An optional "mode": "cox" scores the Cox predictor stored
+in the model header instead of the forest, cached separately.
+diagnostic_codes lists the selected codes only, the input row is built from
+the feature order stored with the model.
+
+{"id": 2, "command": "inflate", "source": "...", "target": "..."} writes the
+uncompressed, memory-mappable form of a downloaded model to target, which
+the dashboard server keeps in its model store.
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from predict import load_model, build_features, predict_patient
+import model_artifact
+from cox_predictor import CoxUnavailable
+
+# Number of deserialized models kept in memory, least recently used is evicted first
+MAX_MODELS = int(os.environ.get("PREDICT_MAX_MODELS", "2"))
+# Number of requests scored at the same time
+MAX_WORKERS = int(os.environ.get("PREDICT_WORKERS", "4"))
+
+
+class ModelNotLoaded(Exception):
+    pass
+
+
+class ModelCache:
+    def __init__(self, max_models):
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+
+    def get(self, modelid, model_path=None, mode="forest"):
+        # The forest and the Cox predictor of a model are cached as separate entries
+        key = (modelid, mode)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+            if model_path is None:
+                raise ModelNotLoaded(f"Model {modelid} is not loaded")
+            # Only one thread loads a given model, the others wait for it
+            load_lock = self.loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key]
+
+            model = load_model(model_path, mode)
+
+            with self.lock:
+                self.models[key] = model
+                self.models.move_to_end(key)
+                while len(self.models) > self.max_models:
+                    self.models.popitem(last=False)
+                self.loading.pop(key, None)
+            return model
+
+
+models = ModelCache(MAX_MODELS)
+output_lock = threading.Lock()
+
+
+def respond(message):
+    with output_lock:
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+
+
+def inflate_model(source, target):
+    # Artifacts are stored deflated in the database; legacy pickles are copied as they are
+    with open(source, "rb") as f:
+        data = f.read()
+    if model_artifact.is_artifact(data):
+        data = model_artifact.inflate(data)
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, target)
+    return {"size": len(data)}
+
+
+def handle(request):
+    request_id = request.get("id")
+    if request.get("command") == "inflate":
+        try:
+            respond({"id": request_id, "result": inflate_model(request["source"], request["target"])})
+        except Exception as e:
+            respond({"id": request_id, "error": f"Model inflating failed: {str(e)}", "code": "inflate_failed"})
+        return
+
+    try:
+        model = models.get(request["modelid"], request.get("model_path"), request.get("mode", "forest"))
+    except ModelNotLoaded as e:
+        respond({"id": request_id, "error": str(e), "code": "model_not_loaded"})
+        return
+    except CoxUnavailable as e:
+        respond({"id": request_id, "error": str(e), "code": "mode_unavailable"})
+        return
+    except Exception as e:
+        respond({"id": request_id, "error": f"Model loading failed: {str(e)}", "code": "model_load_failed"})
+        return
+
+    try:
+        input_data = build_features(
+            model, request["gender"], request["age"], request["readmissions"], request["diagnostic_codes"]
+        )
+        respond({"id": request_id, "result": predict_patient(model, input_data)})
+    except Exception as e:
+        respond({"id": request_id, "error": str(e), "code": "prediction_failed"})
+
+
+def main():
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                respond({"id": None, "error": f"Invalid request: {str(e)}", "code": "invalid_request"})
+                continue
+            executor.submit(handle, request)
+
+
+if __name__ == "__main__":
+    main()
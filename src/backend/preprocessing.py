@@ -0,0 +1,188 @@
+import numpy as np
+
+from readmission import readmission_windows
+from diagnoses import processed_diagnoses
+from feature_matrix import code_counts, code_matrix
+from cox_screening import SCREENING_ENGINES
+import metrics
+
+# Readmission windows: (flag column, count column, window in days)
+READMISSION_WINDOWS = [
+    ("Readmission in 6 Months", "Readmission Count in 6 Months", 180),
+    ("Readmission in 12 Months", "Readmission Count in 12 Months", 365),
+]
+
+# Death flags: (column, window in days)
+DEATH_WINDOWS = [
+    ("Death in 6 Months", 180),
+    ("Death in 12 Months", 365),
+]
+
+# Per-patient columns kept for training
+RETAIN_COLUMNS = [
+    "Patient ID", "Gender", "Age", "Dead", "Death in 12 Months",
+    "Readmission", "Readmission in 6 Months", "Readmission in 12 Months", "Survival Duration (Days)"
+]
+
+
+def shared_visit_features(visits):
+    """Visit-level columns that do not depend on the diagnosis of interest.
+
+    Computed once per upload and shared by every cohort: the date of birth
+    filter, gender and death flags, the death intervals and the processed
+    diagnosis strings. Visits with a death date before the visit keep their
+    row (the any-readmission flag still counts them) but are marked with
+    "Death Before Visit" and get no death interval or processed diagnoses.
+    """
+    # Filter out rows where Date of Birth is greater than Admit/Visit Date/Time
+    with metrics.stage("date filter") as record:
+        df_filtered = visits[visits['Date of Birth'] <= visits['Admit/Visit Date/Time']].copy()
+        record["rows"] = len(df_filtered)
+
+    # FOR GENDER
+    df_filtered['Gender'] = df_filtered['Gender'].map({'MALE': 1, 'FEMALE': 0})
+
+    # FOR DEAD
+    df_filtered["Dead"] = df_filtered["Death Date"].notna().astype(int)
+
+    # Rows with a negative survival duration, i.e. a death date before the visit
+    df_filtered['Death Before Visit'] = df_filtered['Death Date'] < df_filtered['Admit/Visit Date/Time']
+    valid = df_filtered[~df_filtered['Death Before Visit']]
+
+    # Keep what the death flags need: the shortest visit-to-death interval of the
+    # deceased visits and the last visit without a death date
+    death_interval = (valid['Death Date'] - valid['Admit/Visit Date/Time']).dt.days
+    alive_admit = valid['Admit/Visit Date/Time'].where(valid['Death Date'].isna())
+    df_filtered['Min Death Interval (Days)'] = death_interval.groupby(valid['Patient ID']).transform('min')
+    df_filtered['Last Alive Admit Date'] = alive_admit.groupby(valid['Patient ID']).transform('max')
+
+    # Fill missing secondary diagnosis codes with empty strings for consistency
+    df_filtered["Secondary Diagnosis Code Concat (Mediclaim)"] = df_filtered["Secondary Diagnosis Code Concat (Mediclaim)"].fillna("")
+
+    # Combine each visit's primary code with all of the patient's secondary codes,
+    # truncated to 3 characters and deduplicated
+    with metrics.stage("diagnosis combining", len(valid)):
+        df_filtered['Processed Diagnoses'] = processed_diagnoses(df_filtered[~df_filtered['Death Before Visit']])
+
+    return df_filtered
+
+
+def cohort_features(shared, diagnostic_interest, readmission_windows_config=READMISSION_WINDOWS):
+    """One row per patient of interest, from the rows of shared_visit_features.
+
+    Nothing here depends on the current date, so rows can be cached and reused
+    across runs. apply_reference_date adds the date-dependent columns
+    (survival duration, age, death flags) afterwards.
+    """
+    #Step 1: Filter rows with diagnosis
+    patients_of_interest = shared[shared['Primary Diagnosis Code (Mediclaim)'].str.contains(diagnostic_interest, na=False, regex=False)]
+
+    # Step 2: Flag patients with any inpatient readmission after their first visit
+    readmissions = readmission_windows(patients_of_interest, [("Readmission", None, None)])
+
+    # Remove rows with a negative survival duration, i.e. a death date before the visit
+    df_filtered = shared[~shared['Death Before Visit']].copy()
+
+    # Step 3: Map the values back to all rows for each patient
+    df_filtered['Readmission'] = df_filtered['Patient ID'].map(readmissions['Readmission']).fillna(0).astype(int)
+
+    # Step 1: Filter rows with diagnosis
+    patients_of_interest = df_filtered[df_filtered['Primary Diagnosis Code (Mediclaim)'].str.contains(diagnostic_interest, na=False, regex=False)]
+
+    # Step 2: Count readmissions within each window in one pass over the visits
+    with metrics.stage("readmission windows", len(patients_of_interest)):
+        readmissions = readmission_windows(patients_of_interest, readmission_windows_config)
+
+    # Step 3: Map the values back to all rows for each patient
+    for flag_column, count_column, _ in readmission_windows_config:
+        df_filtered[flag_column] = df_filtered['Patient ID'].map(readmissions[flag_column]).fillna(0).astype(int)
+        df_filtered[count_column] = df_filtered['Patient ID'].map(readmissions[count_column]).fillna(0).astype(int)
+
+    """### 2.2.6 Filtering for Patients of Interest"""
+
+    df_filtered = df_filtered[df_filtered['Processed Diagnoses'].str.startswith(diagnostic_interest)]
+
+    # Remove duplicate Patient IDs, keeping the first occurrence
+    df_filtered = df_filtered.drop_duplicates(subset='Patient ID')
+
+    return df_filtered.drop(columns=[
+        'Case Type Description', 'Primary Diagnosis Code (Mediclaim)', 'Secondary Diagnosis Code Concat (Mediclaim)',
+        'Death Before Visit'
+    ]).reset_index(drop=True)
+
+
+def patient_features(visits, diagnostic_interest, readmission_windows_config=READMISSION_WINDOWS):
+    # Features of a single cohort straight from the visits
+    return cohort_features(shared_visit_features(visits), diagnostic_interest, readmission_windows_config)
+
+
+def apply_reference_date(patients, today_date):
+    # Add the columns measured up to today for patients without a death date
+    patients = patients.copy()
+
+    # FOR SURVIVAL DURATION (DAYS)
+    patients['Survival Duration (Days)'] = np.where(
+        patients['Death Date'].isna(),
+        (today_date - patients['Admit/Visit Date/Time']).dt.days,  # If 'death' is NaT, use today_date
+        (patients['Death Date'] - patients['Admit/Visit Date/Time']).dt.days)  # If 'death' has a value, use death date
+
+    # FOR AGE
+    patients['Age'] = np.where(
+        patients['Death Date'].isna(),
+        round((today_date - patients['Date of Birth']).dt.days/365),  # If 'death' is NaT, use today_date
+        round((patients['Death Date'] - patients['Date of Birth']).dt.days/365)
+        )  # If 'death' has a value, use death date
+
+    # 1 if any visit of the patient is followed by death (or today) within the window, 0 otherwise
+    alive_interval = (today_date - patients['Last Alive Admit Date']).dt.days
+    for column, days in DEATH_WINDOWS:
+        patients[column] = ((patients['Min Death Interval (Days)'] <= days) | (alive_interval <= days)).astype(int)
+
+    return patients
+
+
+def select_features(patients, diagnostic_interest, min_code_share=0.01, p_value=0.05, screening="lifelines"):
+    """Frequency filter and Cox screening of the diagnosis codes.
+
+    screening names the engine in SCREENING_ENGINES: "lifelines" (one
+    multivariate CoxPHFitter fit), "score" (univariate score tests) or
+    "lasso" (penalized Cox path).
+
+    Returns (overview_df, diagnosis_matrix, codes): the RETAIN_COLUMNS of
+    every patient, a sparse uint8 matrix of the significant codes and the
+    code of each matrix column.
+    """
+    """### 2.2.7 Dimension Reduction Techniques"""
+
+    # An empty cohort would only fail later inside the Cox fit
+    if len(patients) == 0:
+        raise ValueError(f"No patients with a {diagnostic_interest} diagnosis in the upload")
+
+    # Count each diagnostic code over the patients before building any one-hot columns
+    diagnostic_code_counts = code_counts(patients["Processed Diagnoses"])
+
+    code_count = diagnostic_code_counts.get(diagnostic_interest, 0)
+
+    """#### Keeping only Counts that are >= 1% of Diagnostic Code Count"""
+
+    valid_codes = sorted(
+        code for code in diagnostic_code_counts[diagnostic_code_counts >= code_count * min_code_share].index
+        if code != diagnostic_interest
+    )
+
+    """### 2.2.8 One Hot Encoding on Diagnostic Codes"""
+
+    # Sparse uint8 matrix, one column per valid code in valid_codes order
+    with metrics.stage("one-hot", len(patients)):
+        diagnosis_matrix = code_matrix(patients["Processed Diagnoses"], valid_codes)
+
+    overview_df = patients[RETAIN_COLUMNS].reset_index(drop=True)
+
+    # Only the codes that passed the frequency filter are screened
+    with metrics.stage("cox screening", len(overview_df)):
+        keep = SCREENING_ENGINES[screening](
+            diagnosis_matrix, valid_codes, overview_df["Survival Duration (Days)"], overview_df["Dead"], p_value
+        )
+
+    significant = np.flatnonzero(keep).tolist()
+    return overview_df, diagnosis_matrix[:, significant], [valid_codes[i] for i in significant]
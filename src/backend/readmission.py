@@ -0,0 +1,63 @@
+import math
+import numpy as np
+import pandas as pd
+
+DAY_NS = 24 * 60 * 60 * 10**9
+
+
+def readmission_windows(visits, windows, patient_col='Patient ID', date_col='Admit/Visit Date/Time',
+                        case_col='Case Type Description'):
+    """Count inpatient readmissions per patient for several windows in one pass.
+
+    windows is a list of (flag_column, count_column, days) tuples. days=None means
+    no time limit and count_column=None leaves the count out of the result.
+
+    For every window a patient's first visit sets the baseline date. A later
+    Inpatient visit after the baseline and within the window counts as a
+    readmission and becomes the new baseline; any visit past the window only
+    resets the baseline. Returns one row per patient, indexed by patient_col.
+    """
+    visits = visits[[patient_col, date_col, case_col]].sort_values(
+        [patient_col, date_col], kind='mergesort')
+
+    patient_codes, patients = pd.factorize(visits[patient_col])
+    dates = visits[date_col].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    inpatient = (visits[case_col] == 'Inpatient').to_numpy()
+
+    limits = [math.inf if days is None else days * DAY_NS for _, _, days in windows]
+    n_windows = len(windows)
+    counts = np.zeros((len(patients), n_windows), dtype=np.int64)
+
+    # Single scan over the sorted visit arrays, keeping one baseline per window
+    current_patient = -1
+    baselines = [0] * n_windows
+    patient_counts = None
+    for patient, date, is_inpatient in zip(patient_codes.tolist(), dates.tolist(), inpatient.tolist()):
+        if patient != current_patient:
+            if patient_counts is not None:
+                counts[current_patient] = patient_counts
+            current_patient = patient
+            baselines = [date] * n_windows
+            patient_counts = [0] * n_windows
+            continue
+
+        for w in range(n_windows):
+            baseline = baselines[w]
+            if date <= baseline:
+                continue
+            if date <= baseline + limits[w]:
+                if is_inpatient:
+                    patient_counts[w] += 1
+                    baselines[w] = date
+            else:
+                baselines[w] = date
+
+    if patient_counts is not None:
+        counts[current_patient] = patient_counts
+
+    result = pd.DataFrame(index=pd.Index(patients, name=patient_col))
+    for w, (flag_column, count_column, _) in enumerate(windows):
+        result[flag_column] = (counts[:, w] > 0).astype(int)
+        if count_column is not None:
+            result[count_column] = counts[:, w]
+    return result
@@ -19,7 +19,12 @@ const client = new Client({
   password: "cghrespi",
   database: "cghdb"
 })
-client.connect();
+client.connect()
+  // Columns the model listing reads, added by the trainer if it has not run yet
+  .then(() => client.query(
+    "ALTER TABLE models ADD COLUMN IF NOT EXISTS params JSONB, ADD COLUMN IF NOT EXISTS cv_scores JSONB, ADD COLUMN IF NOT EXISTS metrics JSONB"
+  ))
+  .catch(console.error);
 
 app.get("/", (req, res) => {
   res.send("Received!");
@@ -103,7 +108,7 @@ app.get("/model", async (req, res) => {
   try {
     const result = await client.query(
 
-      `Select m.modelid, m.c_index, m.timestamp 
+      `Select m.modelid, m.c_index, m.timestamp, m.params, m.cv_scores, m.metrics
       From models m`
     );
     if (result.rows.length === 0) {
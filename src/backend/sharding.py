@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+
+from ingest import CHUNKSIZE, DateParser, read_chunks, filter_chunk, empty_visits
+from preprocessing import READMISSION_WINDOWS, shared_visit_features, cohort_features
+import metrics
+
+# Shards of one upload are processed in this many processes
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", os.cpu_count() or 1))
+
+
+def shard_of(patient_ids, n_shards):
+    # Stable hash of the Patient ID, the same patient always lands in the same shard
+    return pd.util.hash_pandas_object(patient_ids, index=False).to_numpy() % n_shards
+
+
+def partition_visits(file_path, shard_dir, n_shards, start_date, end_date, case_types, chunksize=CHUNKSIZE):
+    """Split the visits of an export into n_shards folders by a hash of the Patient ID.
+
+    The export is read in chunks, filtered like read_visits, and every chunk
+    appends one pickle per shard. All visits of a patient end up in the same
+    shard, in file order, so only one chunk is in memory at a time.
+    Returns (shard folders, rows written).
+    """
+    shard_paths = [os.path.join(shard_dir, f"shard_{i}") for i in range(n_shards)]
+    for shard_path in shard_paths:
+        os.makedirs(shard_path, exist_ok=True)
+
+    n_rows = 0
+    dates = DateParser()
+    for part, chunk in enumerate(read_chunks(file_path, chunksize)):
+        chunk = filter_chunk(chunk, start_date, end_date, case_types, dates)
+        if chunk.empty:
+            continue
+        n_rows += len(chunk)
+        for shard, rows in chunk.groupby(shard_of(chunk["Patient ID"], n_shards), sort=False):
+            rows.to_pickle(os.path.join(shard_paths[shard], f"part_{part:06d}.pkl"))
+    dates.check()
+    return shard_paths, n_rows
+
+
+def load_shard(shard_path):
+    # Visits of one shard, sorted like read_visits
+    parts = sorted(name for name in os.listdir(shard_path) if name.startswith("part_"))
+    if not parts:
+        return empty_visits()
+    visits = pd.concat([pd.read_pickle(os.path.join(shard_path, name)) for name in parts], ignore_index=True)
+    return visits.sort_values(by=['Patient ID', 'Admit/Visit Date/Time'])
+
+
+def shard_features(shard_path, diagnostic_interests, readmission_windows=READMISSION_WINDOWS):
+    """Per-patient rows of every cohort, from the visits of one shard.
+
+    Runs in a pool worker. Each cohort's rows go to cohort_<code>.pkl in the
+    shard folder; returns ({code: file}, stage records).
+    """
+    files = {}
+    with metrics.recording() as records:
+        visits = load_shard(shard_path)
+        if visits.empty:
+            return files, records
+        shared = shared_visit_features(visits)
+        for diagnostic_interest in diagnostic_interests:
+            with metrics.stage("cohort features") as record:
+                patients = cohort_features(shared, diagnostic_interest, readmission_windows)
+                record["rows"] = len(patients)
+            files[diagnostic_interest] = os.path.join(shard_path, f"cohort_{diagnostic_interest}.pkl")
+            patients.to_pickle(files[diagnostic_interest])
+    return files, records
+
+
+def merge_patients(files):
+    # One cohort's rows from every shard, in Patient ID order like incremental_patient_features
+    if not files:
+        raise ValueError("No visits in the study window")
+    parts = [pd.read_pickle(file) for file in files]
+    non_empty = [part for part in parts if len(part) > 0]
+    table = pd.concat(non_empty or parts, ignore_index=True)
+    return table.sort_values('Patient ID', kind='mergesort').reset_index(drop=True)
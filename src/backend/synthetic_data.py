@@ -0,0 +1,146 @@
+"""Synthetic hospital visit exports with the columns /fileUpload expects.
+
+Usage: python synthetic_data.py <n_visits> <output.csv|output.xlsx> [--seed N]
+
+Visits are generated patient by patient in vectorized chunks and appended to
+the output, so 10M visits need no more memory than one chunk. Secondary codes
+are joined with '||' like the Mediclaim export, with the same occasional
+empty and trailing-separator values.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+EXPORT_COLUMNS = [
+    'Patient ID',
+    'Admit/Visit Date/Time',
+    'Date of Birth',
+    'Gender',
+    'Race',
+    'Death Date',
+    'Case Type Description',
+    'Primary Diagnosis Code (Mediclaim)',
+    'Secondary Diagnosis Code Concat (Mediclaim)',
+    'Discharge Date/Time',
+]
+
+# ICD-10 codes seen in COPD cohorts, J44 variants make up most primary diagnoses
+PRIMARY_CODES = ['J44', 'J44.0', 'J44.1', 'J44.9', 'J18.9', 'I50.9', 'E11.9', 'I10', 'N39.0', 'A41.9']
+PRIMARY_WEIGHTS = [0.3, 0.1, 0.15, 0.1, 0.07, 0.07, 0.06, 0.06, 0.05, 0.04]
+SECONDARY_CODES = [
+    'E11.9', 'I10', 'I50.9', 'E87.1', 'J96.0', 'N39.0', 'A41.9', 'Z51.1', 'I21.4', 'K59.0',
+    'R94.3', 'E78.5', 'I48.9', 'N18.3', 'F32.9', 'D64.9', 'J45.9', 'M81.0', 'G47.3', 'Z87.8',
+]
+# Comorbidities that raise the death rate, so Cox screening has something to find
+HIGH_RISK_CODES = ['I50.9', 'J96.0', 'A41.9', 'N18.3']
+CASE_TYPES = ['A&E', 'Inpatient', 'Outpatient', 'Day Surgery']
+CASE_WEIGHTS = [0.35, 0.35, 0.25, 0.05]
+
+FIRST_VISIT = np.datetime64('2017-01-01')
+LAST_VISIT = np.datetime64('2023-12-31')
+MEAN_VISITS = 8
+
+
+def generate_chunk(rng, first_patient, n_patients):
+    """Visits of n_patients patients, numbered from first_patient, as a DataFrame."""
+    visits_per_patient = rng.geometric(1 / MEAN_VISITS, n_patients)
+    patient = np.repeat(np.arange(n_patients), visits_per_patient)
+    n_visits = len(patient)
+
+    # Per-patient attributes
+    span = int((LAST_VISIT - FIRST_VISIT).astype(int))
+    birth = np.datetime64('1925-01-01') + rng.integers(0, 60 * 365, n_patients).astype('timedelta64[D]')
+    gender = rng.choice(np.array(['MALE', 'FEMALE']), n_patients, p=[0.6, 0.4])
+    race = rng.choice(np.array(['CHINESE', 'MALAY', 'INDIAN', 'OTHERS']), n_patients)
+    comorbidities = rng.choice(np.array(SECONDARY_CODES), (n_patients, 3))
+    risk = np.isin(comorbidities, HIGH_RISK_CODES).sum(axis=1)
+    dies = rng.random(n_patients) < 0.2 + 0.15 * risk
+
+    # Visits sorted by date within each patient
+    admit_day = rng.integers(0, span, n_visits)
+    order = np.lexsort((admit_day, patient))
+    admit_day = admit_day[order]
+    admit = (FIRST_VISIT + admit_day.astype('timedelta64[D]')).astype('datetime64[s]') \
+        + rng.integers(0, 86400, n_visits).astype('timedelta64[s]')
+    last_visit = np.maximum.reduceat(admit_day, np.concatenate([[0], np.cumsum(visits_per_patient)[:-1]]))
+
+    # Deaths mostly follow the last visit, sooner with more risk codes, a few dates are recorded before it
+    death_day = last_visit - 30 + rng.exponential(900 / (1 + risk)).astype(np.int64)
+    death = np.where(dies, FIRST_VISIT + death_day.astype('timedelta64[D]'), np.datetime64('NaT'))
+
+    primary = rng.choice(np.array(PRIMARY_CODES), n_visits, p=PRIMARY_WEIGHTS)
+    n_secondary = rng.integers(0, 5, n_visits)
+    # Most secondary codes are the patient's own comorbidities
+    secondary_codes = np.where(
+        rng.random((n_visits, 4)) < 0.7,
+        comorbidities[patient[:, None], rng.integers(0, 3, (n_visits, 4))],
+        rng.choice(np.array(SECONDARY_CODES), (n_visits, 4)),
+    )
+    secondary = np.array(['||'.join(codes[:k]) for codes, k in zip(secondary_codes.tolist(), n_secondary.tolist())], dtype=object)
+    trailing = rng.random(n_visits) < 0.05
+    secondary[trailing] = secondary[trailing] + '||'
+    secondary[(n_secondary == 0) & (rng.random(n_visits) < 0.5)] = None
+
+    frame = pd.DataFrame({
+        'Patient ID': np.char.add('P', (first_patient + patient).astype(str)).astype(object),
+        'Admit/Visit Date/Time': admit,
+        'Date of Birth': birth[patient],
+        'Gender': gender[patient],
+        'Race': race[patient],
+        'Death Date': death[patient],
+        'Case Type Description': rng.choice(np.array(CASE_TYPES), n_visits, p=CASE_WEIGHTS),
+        'Primary Diagnosis Code (Mediclaim)': primary,
+        'Secondary Diagnosis Code Concat (Mediclaim)': secondary,
+        'Discharge Date/Time': admit + rng.integers(0, 14 * 86400, n_visits).astype('timedelta64[s]'),
+    })
+    return frame[EXPORT_COLUMNS]
+
+
+def generate_visits(n_visits, seed=0, chunk_patients=100_000):
+    # Yields DataFrame chunks until n_visits visits were generated
+    rng = np.random.default_rng(seed)
+    generated = 0
+    first_patient = 0
+    while generated < n_visits:
+        # Small exports do not generate a full chunk of patients
+        n_patients = min(chunk_patients, (n_visits - generated) // MEAN_VISITS + 1)
+        chunk = generate_chunk(rng, first_patient, n_patients)
+        chunk = chunk.iloc[:n_visits - generated]
+        generated += len(chunk)
+        first_patient += n_patients
+        yield chunk
+
+
+def write_export(path, n_visits, seed=0):
+    """Write a synthetic export of n_visits visits to a CSV or XLSX file."""
+    extension = os.path.splitext(path)[1].lower()
+    chunks = generate_visits(n_visits, seed)
+    if extension == ".csv":
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    elif extension == ".xlsx":
+        if n_visits > 1_048_575:
+            raise ValueError("XLSX sheets hold at most 1,048,575 visits, write a CSV instead")
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(EXPORT_COLUMNS)
+        for chunk in chunks:
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False):
+                sheet.append(list(row))
+        workbook.save(path)
+    else:
+        raise ValueError(f"Unsupported output format: {extension}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic hospital visit export")
+    parser.add_argument("n_visits", type=int)
+    parser.add_argument("output_path", help="CSV or XLSX file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_export(args.output_path, args.n_visits, args.seed)
@@ -0,0 +1,362 @@
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sksurv.ensemble import RandomSurvivalForest
+
+from ingest import read_visits
+from feature_matrix import save_features, load_features, feature_matrix, to_dataframe, survival_target
+from preprocessing import READMISSION_WINDOWS, shared_visit_features, cohort_features, apply_reference_date, select_features
+from pipeline_cache import StageCache, file_digest, params_digest, incremental_patient_features, swap_in
+from sharding import SHARD_WORKERS, partition_visits, shard_features, merge_patients
+import model_artifact
+import db
+from model_search import search_forest
+from time_grid import grid_times, discretize, grid_report
+from evaluation import model_report
+from cox_predictor import fit_cox_predictor
+import metrics
+
+OUTPUT_FOLDER = "output"
+
+# What Diagnosis are you interested in?
+DIAGNOSTIC_INTEREST = "J44"
+
+# # we are only looking at Data from 1st Oct 2017 to 1st June 2023
+START_DATE = pd.Timestamp('2017-10-01')
+END_DATE = pd.Timestamp('2023-06-01')
+CASE_TYPES = ['A&E', 'Inpatient']
+
+
+def copy_output(source, destination):
+    # Copy a file or a features folder
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy(source, destination)
+
+
+def publish(file_path, folder=OUTPUT_FOLDER):
+    # Copy a job output to output/ as the latest version, replacing the old one in one step
+    os.makedirs(folder, exist_ok=True)
+    final_path = os.path.join(folder, os.path.basename(file_path))
+    if os.path.isdir(file_path):
+        # Folders are versioned behind a symlink, see swap_in
+        return swap_in(final_path, lambda version_path: shutil.copytree(file_path, version_path, dirs_exist_ok=True))
+    temp_path = f"{final_path}.tmp-{uuid.uuid4().hex}"
+    shutil.copy(file_path, temp_path)
+    os.replace(temp_path, final_path)
+    return final_path
+
+
+def export_csv(features_file, csv_path):
+    """Dense CSV of a features folder, written on its first download and reused after."""
+    if not os.path.exists(csv_path):
+        frame, matrix, codes = load_features(features_file)
+        temp_path = f"{csv_path}.tmp-{uuid.uuid4().hex}"
+        with metrics.stage("csv export", len(frame)):
+            to_dataframe(frame, matrix, codes).to_csv(temp_path, index=False)
+        os.replace(temp_path, csv_path)
+    return csv_path
+
+
+# Cohorts of one upload are built side by side in this many processes
+COHORT_WORKERS = int(os.environ.get("COHORT_WORKERS", os.cpu_count() or 1))
+
+# Visit rows shared by the cohort pool workers, set once per worker
+_shared_visits = None
+
+
+def _set_shared_visits(shared):
+    global _shared_visits
+    _shared_visits = shared
+
+
+def cohort_files(job, diagnostic_interest):
+    return {
+        "features_file": job.path(f"processed_features_{diagnostic_interest}"),
+        "output_file": job.path(f"processed_data_{diagnostic_interest}.csv"),
+    }
+
+
+def build_cohort(diagnostic_interest, patient_key, result_key, files, today_date, screening,
+                 min_code_share, p_value, shared=None, patient_files=None):
+    """Feature files of one diagnosis cohort, from the shared visit rows.
+
+    Runs in the cohort pool, where the shared rows come from _set_shared_visits.
+    In sharded mode patient_files holds the cohort's per-patient rows of every
+    shard instead, which are merged here. Returns the stage records, which the
+    job process adds to its own.
+    """
+    shared = _shared_visits if shared is None else shared
+    cache = StageCache()
+    with metrics.recording() as records:
+        if cache.has("features", result_key):
+            copy_output(cache.file("features", result_key, "processed_features"), files["features_file"])
+            return records
+
+        if patient_files is not None:
+            with metrics.stage("merge shards") as record:
+                patients = merge_patients(patient_files)
+                record["rows"] = len(patients)
+        else:
+            # Per-patient features, only patients whose rows changed since the last upload are recomputed
+            with metrics.stage("cohort features") as record:
+                patients, record["rows"] = incremental_patient_features(
+                    cache, patient_key, shared,
+                    lambda rows: cohort_features(rows, diagnostic_interest, READMISSION_WINDOWS)
+                )
+        with metrics.stage("reference date", len(patients)):
+            patients = apply_reference_date(patients, today_date)
+
+        # Frequency filter and Cox screening of the diagnostic codes
+        overview_df, diagnosis_matrix, codes = select_features(
+            patients, diagnostic_interest, min_code_share, p_value, screening
+        )
+
+        # Features used by training, one typed .npy per column with the code matrix kept sparse.
+        # The CSV is only written when it is downloaded, see export_csv
+        with metrics.stage("write features", len(overview_df)):
+            save_features(files["features_file"], overview_df, diagnosis_matrix, codes)
+
+        # The cache keeps the folder under its single-cohort name
+        cache.save_files("features", result_key, files["features_file"], names=["processed_features"])
+    return records
+
+
+def preprocess_upload(job, file_path, diagnostic_interests=(DIAGNOSTIC_INTEREST,), screening="lifelines", shards=None):
+    """Turn an uploaded hospital export into the model features of one or more cohorts.
+
+    diagnostic_interests lists ICD-10 prefixes (e.g. ["J44", "J45", "I50"]).
+    The export is read, filtered and its diagnoses combined once; the
+    readmission windows, code selection and feature files are then built per
+    diagnosis, in parallel. screening picks the Cox screening engine for the
+    diagnosis codes (see cox_screening).
+
+    With shards (a number of partitions) the export is split on disk by a hash
+    of the Patient ID and the per-patient stages run on each shard in a
+    process pool, so memory follows the shard size instead of the export.
+    The per-patient rows are merged before the code selection. This mode
+    skips the incremental visit and patient caches.
+
+    Every cohort gets a processed_features_<code> folder (used by training) in
+    the workspace, published to output/. The first cohort is also written as
+    processed_features. Returns the paths of the first cohort and, under
+    "cohorts", those of every cohort; "output_file" is where export_csv writes
+    the CSV download when it is asked for.
+    """
+    if isinstance(diagnostic_interests, str):
+        diagnostic_interests = [diagnostic_interests]
+    diagnostic_interests = list(dict.fromkeys(diagnostic_interests))
+    cache = StageCache()
+    # Old entries of earlier uploads are dropped first, the cache would otherwise only grow
+    cache.evict()
+    today_date = datetime.now()
+
+    # Every stage is cached under a hash of the uploaded file and the parameters it depends on
+    job.stage("Hashing upload", 0.0)
+    file_key = file_digest(file_path)
+    ingest_params = dict(start_date=START_DATE, end_date=END_DATE, case_types=CASE_TYPES)
+    cohorts = []
+    for diagnostic_interest in diagnostic_interests:
+        patient_params = dict(ingest_params, diagnostic_interest=diagnostic_interest, readmission_windows=READMISSION_WINDOWS)
+        feature_params = dict(patient_params, reference_date=today_date.date(), min_code_share=0.01, p_value=0.05, screening=screening)
+        cohorts.append(dict(
+            diagnostic_interest=diagnostic_interest,
+            patient_key=params_digest(**patient_params),
+            result_key=params_digest(file=file_key, **feature_params),
+            files=cohort_files(job, diagnostic_interest),
+            today_date=today_date,
+            screening=screening,
+            min_code_share=feature_params["min_code_share"],
+            p_value=feature_params["p_value"],
+        ))
+
+    # The shared stages are only needed when some cohort is not cached yet
+    shared = None
+    if shards and not all(cache.has("features", cohort["result_key"]) for cohort in cohorts):
+        job.stage("Partitioning visits", 0.1)
+        with metrics.stage("partition visits") as record:
+            shard_paths, record["rows"] = partition_visits(
+                file_path, job.path("shards"), shards, START_DATE, END_DATE, CASE_TYPES
+            )
+
+        # Date filter, diagnoses and readmission windows of every cohort, one shard per task
+        job.stage("Per-patient features", 0.3)
+        patient_files = {code: [] for code in diagnostic_interests}
+        with ProcessPoolExecutor(max_workers=max(1, min(SHARD_WORKERS, shards))) as pool:
+            futures = [pool.submit(shard_features, shard_path, diagnostic_interests) for shard_path in shard_paths]
+            for future in futures:
+                files, records = future.result()
+                metrics.add_records(records)
+                for code, patients_file in files.items():
+                    patient_files[code].append(patients_file)
+        for cohort in cohorts:
+            cohort["patient_files"] = patient_files[cohort["diagnostic_interest"]]
+    elif not all(cache.has("features", cohort["result_key"]) for cohort in cohorts):
+        # Read only the columns we use, parsing dates once and keeping only a&e and inpatient
+        # visits in the date window while the file is read in chunks
+        job.stage("Reading visits", 0.1)
+        visits_key = params_digest(file=file_key, **ingest_params)
+        casetype_df = cache.load_frame("visits", visits_key)
+        if casetype_df is None:
+            with metrics.stage("ingest") as record:
+                casetype_df = read_visits(file_path, START_DATE, END_DATE, CASE_TYPES)
+                record["rows"] = len(casetype_df)
+            cache.save_frames("visits", visits_key, frame=casetype_df)
+
+        # Date filter, death intervals and combined diagnoses, once for all cohorts and
+        # only for patients whose visits changed since the last upload
+        job.stage("Combining diagnoses", 0.3)
+        with metrics.stage("shared visit features") as record:
+            shared, record["rows"] = incremental_patient_features(
+                cache, params_digest(**ingest_params), casetype_df, shared_visit_features
+            )
+
+    # Readmission windows, code selection and feature files per cohort
+    job.stage("Building cohorts", 0.5)
+    if len(cohorts) == 1:
+        metrics.add_records(build_cohort(**cohorts[0], shared=shared))
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, min(COHORT_WORKERS, len(cohorts))),
+                                 initializer=_set_shared_visits, initargs=(shared,)) as pool:
+            futures = [pool.submit(build_cohort, **cohort) for cohort in cohorts]
+            for future in futures:
+                metrics.add_records(future.result())
+
+    # The shards are only needed until the cohorts are built
+    shutil.rmtree(job.path("shards"), ignore_errors=True)
+
+    job.stage("Publishing features", 0.95)
+    for cohort in cohorts:
+        publish(cohort["files"]["features_file"])
+
+    # The first cohort is also what /fileUpload returns and /train uses by default
+    primary = cohorts[0]["files"]
+    result = {"features_file": job.path("processed_features"), "output_file": job.path("processed_data.csv")}
+    copy_output(primary["features_file"], result["features_file"])
+    publish(result["features_file"])
+    result["cohorts"] = {cohort["diagnostic_interest"]: cohort["files"] for cohort in cohorts}
+    return result
+
+
+# Hyperparameters used when no search is requested
+RSF_PARAMS = dict(n_estimators=100, min_samples_split=10, min_samples_leaf=15, max_features="sqrt")
+
+
+def train_model(job, features_file, search=None, time_grid=None):
+    """Fit the random survival forest on a features file and store it in the models table.
+
+    With search (a dict of search_forest options, e.g. {"folds": 5, "n_iter": 10})
+    the hyperparameters come from a cross-validated search on the training
+    split instead of RSF_PARAMS, and the chosen configuration and its fold
+    scores are stored with the model.
+
+    With time_grid ({"width": 7} for weekly bins or {"quantiles": 100}) the
+    forest is fitted on durations snapped to that grid, which keeps far fewer
+    time points per leaf. A forest on the exact durations is fitted as well
+    to report the concordance and horizon survival drift of the binned one.
+
+    A ridge-penalized Cox model is fitted on the same features and stored in
+    the model header, see cox_predictor. If that fit fails the model is saved
+    without it.
+    """
+    # Load dataset, the diagnostic codes stay a sparse uint8 matrix
+    job.stage("Loading features", 0.0)
+    with metrics.stage("load features") as record:
+        df, diagnosis_matrix, diagnostic_codes = load_features(features_file)
+        record["rows"] = len(df)
+
+    # Convert event and time columns into a structured survival array
+    data_y = survival_target(df["Dead"], df["Survival Duration (Days)"])
+
+    # # Define predictor variables
+    feature_columns = [col for col in df.columns if col not in ["Patient ID", "Dead", "Survival Duration (Days)"]] + diagnostic_codes
+    X = feature_matrix(df, diagnosis_matrix, diagnostic_codes, feature_columns)
+
+    # Split into training and testing sets
+    X_train, X_test, y_train, y_test = train_test_split(X, data_y, test_size=0.2, random_state=42)
+
+    # Cross-validated hyperparameter search on the training split
+    params = RSF_PARAMS
+    search_result = None
+    if search is not None:
+        job.stage("Searching hyperparameters", 0.1)
+        with metrics.stage("hyperparameter search", X_train.shape[0]):
+            search_result = search_forest(X_train, y_train, progress=lambda done: job.update(progress=0.1 + 0.6 * done), **search)
+        params = search_result["best_params"]
+        print(f"Best parameters: {params} (mean concordance {search_result['best_score']:.3f})")
+
+    # Optionally fit on durations binned to a time grid, the test split keeps the exact durations
+    y_fit = y_train
+    if time_grid is not None:
+        grid = grid_times(y_train["Survival Duration (Days)"], y_train["Dead"], **time_grid)
+        y_fit = discretize(y_train, grid)
+
+    #Train Random Survival Forest model
+    job.stage("Fitting random survival forest", 0.7 if search is not None else 0.1)
+    with metrics.stage("rsf fit", X_train.shape[0]):
+        rsf = RandomSurvivalForest(**params, n_jobs=-1, random_state=42)
+        rsf.fit(X_train, y_fit)
+
+    # Model evaluation
+    job.stage("Scoring model", 0.8)
+    with metrics.stage("scoring", X_test.shape[0]):
+        model_metrics = model_report(rsf, X_test, y_test, y_train)
+        c_index = model_metrics.pop("c_index_exact")
+    print(f"Concordance Index: {c_index:.3f}")
+    c_index = round(float(c_index),3)
+
+    # Cox predictor stored in the model header, for the dashboard's fast prediction mode
+    job.stage("Fitting Cox predictor", 0.83)
+    with metrics.stage("cox fit", X_train.shape[0]):
+        cox = fit_cox_predictor(X_train, y_train, X_test, y_test, feature_columns)
+    model_metrics["cox_c_index"] = None if cox is None else cox["c_index"]
+
+    # How far the binned model is from one fitted on the exact durations
+    grid_report_result = None
+    if time_grid is not None:
+        job.stage("Comparing with exact durations", 0.85)
+        with metrics.stage("exact rsf fit", X_train.shape[0]):
+            exact = RandomSurvivalForest(**params, n_jobs=-1, random_state=42)
+            exact.fit(X_train, y_train)
+        grid_report_result = grid_report(exact, rsf, X_test, y_test)
+        # Both forests serialized alone, so the two sizes compare the time grids only
+        grid_report_result["artifact_bytes_exact"] = len(model_artifact.dumps(exact))
+        grid_report_result["artifact_bytes_binned"] = len(model_artifact.dumps(rsf))
+        print(f"Time grid {time_grid}: {grid_report_result}")
+
+    # The model was fitted on a sparse matrix, record the column order for predict.py
+    rsf.feature_names_in_ = np.array(feature_columns, dtype=object)
+
+    #Serialize model as a compressed artifact to store in DB
+    job.stage("Saving model", 0.9)
+    cv_scores = None if search_result is None else {
+        "folds": search_result["folds"],
+        "fold_scores": search_result["fold_scores"],
+        "mean_score": search_result["best_score"],
+    }
+    model_binary = model_artifact.dumps(
+        rsf, c_index=c_index, cv_scores=cv_scores, codes=diagnostic_codes, time_grid=time_grid,
+        grid_report=grid_report_result, cox=cox,
+    )
+
+    #Save the diagnostic codes in database, together with the model so a
+    #cancelled or failed job leaves the previous codes in place
+    with metrics.stage("db write", len(diagnostic_codes)), db.connection() as conn:
+        # Only the codes that changed since the last model are written
+        db.sync_codes(conn, diagnostic_codes)
+
+        #Insert model into PostgreSQL, with the hyperparameters and cross-validation scores
+        stored_params = params if time_grid is None else dict(params, time_grid=time_grid)
+        modelid = db.insert_model(conn, model_binary, c_index, stored_params, cv_scores, model_metrics)
+
+    return {
+        "modelid": modelid, "c_index": c_index, "params": params, "cv_scores": cv_scores,
+        "time_grid": time_grid, "grid_report": grid_report_result, "metrics": model_metrics,
+    }
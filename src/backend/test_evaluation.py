@@ -0,0 +1,32 @@
+"""concordance_index against sksurv's concordance_index_censored."""
+import numpy as np
+import pytest
+from sksurv.metrics import concordance_index_censored
+
+from evaluation import concordance_index
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n", [2, 50, 3000])
+def test_matches_sksurv_with_ties(seed, n):
+    rng = np.random.default_rng(seed)
+    event = rng.random(n) < 0.6
+    event[0] = True
+    # Few distinct days and risks, so many pairs tie in time, in risk or in both
+    time = rng.integers(1, 40, n).astype(np.float64)
+    risk = np.round(rng.normal(size=n), 1)
+    expected = concordance_index_censored(event, time, risk)[0]
+    if np.isnan(expected):
+        assert np.isnan(concordance_index(event, time, risk))
+    else:
+        assert concordance_index(event, time, risk) == pytest.approx(expected, abs=1e-12)
+
+
+def test_hand_counted_pairs():
+    event = [True, False, True, True]
+    time = [5, 5, 8, 10]
+    risk = [0.9, 0.1, 0.5, 0.5]
+    # Event at 5 vs censored 5, 8 and 10: 3 concordant. Event at 8 vs 10: tied risk, one half
+    assert concordance_index(event, time, risk) == pytest.approx(3.5 / 4)
+    expected = concordance_index_censored(np.array(event), np.array(time, dtype=np.float64), np.array(risk))[0]
+    assert expected == pytest.approx(3.5 / 4)
@@ -0,0 +1,57 @@
+"""ForestEngine against sksurv's RandomSurvivalForest, and the model artifact round trip."""
+import numpy as np
+import pytest
+from sksurv.ensemble import RandomSurvivalForest
+
+import model_artifact
+from feature_matrix import survival_target
+from forest_engine import ForestEngine
+
+DAYS = [30, 180, 365, 900]
+
+
+@pytest.fixture(scope="module")
+def forest():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(300, 6)).astype(np.float32)
+    # Whole days, so the forest has tied event times like the real cohorts
+    duration = np.ceil(rng.exponential(scale=np.exp(-X[:, 0] + 0.5 * X[:, 1])) * 500)
+    y = survival_target((rng.random(len(X)) > 0.25).astype(int), duration)
+    rsf = RandomSurvivalForest(n_estimators=20, min_samples_split=10, min_samples_leaf=5, random_state=42)
+    rsf.fit(X[:240], y[:240])
+    return rsf, X[240:]
+
+
+def test_engine_matches_sksurv(forest):
+    rsf, X = forest
+    engine = ForestEngine(*model_artifact.loads(model_artifact.dumps(rsf)))
+
+    expected_survival = rsf.predict_survival_function(X, return_array=True)
+    np.testing.assert_allclose(engine.predict_survival_function(X), expected_survival, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(engine.predict(X), rsf.predict(X), rtol=1e-5)
+
+    step_functions = rsf.predict_survival_function(X)
+    expected_at = np.array([fn(DAYS) for fn in step_functions])
+    np.testing.assert_allclose(engine.predict_survival_at(X, DAYS), expected_at, rtol=0, atol=1e-6)
+
+
+def test_artifact_round_trip(forest, tmp_path):
+    rsf, X = forest
+    arrays = model_artifact.forest_arrays(rsf)
+    metadata = dict(c_index=0.7, codes=["E11", "I50"], created="2024-01-01T00:00:00")
+    compressed = model_artifact.dumps(rsf, **metadata)
+    raw = model_artifact.dumps(rsf, compress=False, **metadata)
+    assert model_artifact.inflate(compressed) == raw
+
+    path = tmp_path / "model.artifact"
+    path.write_bytes(raw)
+    for header, loaded in (model_artifact.loads(compressed), model_artifact.load(str(path))):
+        assert header["c_index"] == 0.7 and header["codes"] == ["E11", "I50"]
+        assert header["n_estimators"] == rsf.n_estimators
+        assert set(loaded) == set(arrays)
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(loaded[name], array)
+    assert model_artifact.read_header(str(path))["unique_times"] == rsf.unique_times_.tolist()
+
+    # A loaded engine scores like the forest it was saved from
+    np.testing.assert_allclose(ForestEngine.load(str(path)).predict(X), rsf.predict(X), rtol=1e-5)
@@ -0,0 +1,52 @@
+"""Date parsing of uploaded exports in ingest."""
+import pandas as pd
+import pytest
+
+from ingest import DATE_COLUMNS, read_visits
+from synthetic_data import write_export
+from tasks import START_DATE, END_DATE, CASE_TYPES
+
+
+@pytest.fixture(scope="module")
+def exports(tmp_path_factory):
+    # The same visits with ISO dates and with day-first dates
+    folder = tmp_path_factory.mktemp("exports")
+    iso_path = str(folder / "iso.csv")
+    write_export(iso_path, 2000, seed=5)
+    visits = pd.read_csv(iso_path, dtype=str)
+    for col in DATE_COLUMNS:
+        visits[col] = pd.to_datetime(visits[col]).dt.strftime('%d/%m/%Y %H:%M')
+    dayfirst_path = str(folder / "dayfirst.csv")
+    visits.to_csv(dayfirst_path, index=False)
+    return iso_path, dayfirst_path, visits
+
+
+def read(path, **kwargs):
+    return read_visits(path, START_DATE, END_DATE, CASE_TYPES, chunksize=300, **kwargs).reset_index(drop=True)
+
+
+def test_inferred_format_reads_every_visit(exports):
+    iso_path, dayfirst_path, _ = exports
+    # Day-first dates are only unambiguous with the format given
+    expected = read(iso_path)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(read(dayfirst_path, date_format='%d/%m/%Y %H:%M'), expected)
+
+
+def test_unparsed_dates_fail_the_upload(exports, tmp_path):
+    _, _, visits = exports
+    visits = visits.copy()
+    visits.loc[::10, 'Admit/Visit Date/Time'] = '2019-13-45'
+    path = str(tmp_path / "bad.csv")
+    visits.to_csv(path, index=False)
+    with pytest.raises(ValueError, match="'Admit/Visit Date/Time' values are not dates"):
+        read(path, date_format='%d/%m/%Y %H:%M')
+
+
+def test_a_few_unparsed_dates_are_dropped(exports, tmp_path):
+    iso_path, _, _ = exports
+    visits = pd.read_csv(iso_path, dtype=str)
+    visits.loc[:2, 'Death Date'] = 'unknown'
+    path = str(tmp_path / "few.csv")
+    visits.to_csv(path, index=False)
+    assert len(read(path)) == len(read(iso_path))
@@ -0,0 +1,59 @@
+"""Cross-validated hyperparameter search of model_search."""
+import numpy as np
+import pytest
+from sksurv.ensemble import RandomSurvivalForest
+
+from feature_matrix import survival_target
+from model_search import fit_fold, search_forest, write_folds
+
+FOLDS = 4
+
+
+@pytest.fixture(scope="module")
+def cohort():
+    # Survival driven by the first feature, a third of the patients censored
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(240, 4)).astype(np.float32)
+    duration = rng.exponential(scale=np.exp(-1.5 * X[:, 0])) * 1000 + 1
+    dead = rng.random(len(X)) > 0.3
+    return X, survival_target(dead.astype(int), duration)
+
+
+def test_warm_started_scores_match_cold_fits(cohort, tmp_path):
+    X, y = cohort
+    write_folds(str(tmp_path), X, y, FOLDS)
+    params = {"min_samples_split": 10, "min_samples_leaf": 5, "max_features": "sqrt"}
+    for fold in range(FOLDS):
+        warm = fit_fold(str(tmp_path), fold, params, [5, 10, 20])
+        X_train, y_train = np.load(tmp_path / f"X_train_{fold}.npy"), np.load(tmp_path / f"y_train_{fold}.npy")
+        X_test, y_test = np.load(tmp_path / f"X_test_{fold}.npy"), np.load(tmp_path / f"y_test_{fold}.npy")
+        for count, score in warm.items():
+            cold = RandomSurvivalForest(n_estimators=count, n_jobs=1, random_state=42, **params).fit(X_train, y_train)
+            assert score == pytest.approx(cold.score(X_test, y_test), abs=1e-12)
+
+
+def test_losing_configurations_stop_early(cohort):
+    X, y = cohort
+    # A 150-sample leaf cannot split the ~180 training rows, so it scores 0.5 on every fold
+    space = {"n_estimators": [10], "min_samples_split": [10], "min_samples_leaf": [3, 150], "max_features": [None]}
+    result = search_forest(X, y, space=space, folds=FOLDS, workers=2, min_folds=2)
+
+    fold_counts = {r["params"]["min_samples_leaf"]: len(r["fold_scores"]) for r in result["results"]}
+    assert fold_counts == {3: FOLDS, 150: 2}
+    assert result["best_params"]["min_samples_leaf"] == 3
+
+
+def test_best_configuration_is_complete(cohort):
+    X, y = cohort
+    space = {"n_estimators": [5, 15], "min_samples_split": [10], "min_samples_leaf": [3, 8], "max_features": ["sqrt"]}
+    result = search_forest(X, y, space=space, folds=FOLDS, workers=2)
+
+    assert set(result["best_params"]) == set(space)
+    assert result["folds"] == FOLDS
+    assert len(result["fold_scores"]) == FOLDS
+    assert result["best_score"] == pytest.approx(np.mean(result["fold_scores"]))
+    assert len(result["results"]) == 4
+    complete = [r for r in result["results"] if r["complete"]]
+    assert result["best_score"] == max(r["mean_score"] for r in complete)
+    best = next(r for r in complete if r["params"] == result["best_params"])
+    assert best["fold_scores"] == result["fold_scores"]
@@ -0,0 +1,30 @@
+"""Dashboard inputs to model rows in predict.build_features."""
+import numpy as np
+import pytest
+
+from cox_predictor import CoxPredictor
+from predict import build_features
+
+FEATURES = ["Gender", "Age", "Readmission", "E11", "I50"]
+
+
+@pytest.fixture
+def model():
+    cox = {
+        "feature_names": FEATURES, "coef": [0.1, 0.02, 0.5, 0.3, 0.8],
+        "times": [0.0, 100.0], "baseline_survival": [1.0, 0.9],
+    }
+    return CoxPredictor({"cox": cox, "codes": ["E11", "I50"]})
+
+
+def test_row_in_model_order(model):
+    row = build_features(model, "1", "70", 0, ["I50", "J96"])
+    np.testing.assert_array_equal(row, [[1, 70, 0, 0, 1]])
+
+
+@pytest.mark.parametrize("readmissions", [1, 3, "12"])
+def test_readmission_count_becomes_the_trained_flag(model, readmissions):
+    row = build_features(model, 0, 60, readmissions, [])
+    assert row[0, FEATURES.index("Readmission")] == 1
+    # The Cox risk stays in the range of the training rows
+    assert model.predict(row)[0] == pytest.approx(60 * 0.02 + 0.5)
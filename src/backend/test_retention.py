@@ -0,0 +1,52 @@
+"""Retention of job folders and stage cache entries."""
+import os
+import time
+
+import pandas as pd
+
+import pipeline_cache
+from jobs import JobQueue, DONE, RUNNING
+from pipeline_cache import StageCache
+
+DAY = 86400
+
+
+def age(path, days):
+    when = time.time() - days * DAY
+    os.utime(path, (when, when), follow_symlinks=False)
+
+
+def test_finished_jobs_expire(tmp_path):
+    queue = JobQueue(root=str(tmp_path))
+    old, recent, stuck = (queue.create("preprocess") for _ in range(3))
+    old.update(state=DONE, finished=time.time() - 8 * DAY)
+    recent.update(state=DONE, finished=time.time() - DAY)
+    stuck.update(state=RUNNING)
+
+    removed = queue.remove_expired(max_age_days=7)
+    assert removed == [os.path.basename(old.job_dir)]
+    assert not os.path.exists(old.job_dir)
+    assert os.path.exists(recent.job_dir) and os.path.exists(stuck.job_dir)
+
+
+def test_unused_cache_entries_are_evicted(tmp_path, monkeypatch):
+    cache = StageCache(root=str(tmp_path))
+    frame = pd.DataFrame({"a": [1, 2]})
+    cache.save_frames("visits", "old", frame=frame)
+    cache.save_frames("visits", "used", frame=frame)
+    age(cache.path("visits", "old"), 20)
+    age(cache.path("visits", "used"), 20)
+    # Loading an entry counts as a use
+    cache.load_frame("visits", "used")
+
+    assert cache.evict(max_age_days=14) == 1
+    assert not cache.has("visits", "old")
+    pd.testing.assert_frame_equal(cache.load_frame("visits", "used"), frame)
+
+    # The evicted version is only deleted once nobody can still be reading it
+    versions = [entry for entry in os.listdir(tmp_path / "visits") if entry.startswith("old.v")]
+    assert len(versions) == 1
+    monkeypatch.setattr(pipeline_cache, "STALE_VERSION_SECONDS", -1)
+    cache.evict(max_age_days=14)
+    assert sorted(os.listdir(tmp_path / "visits"))[0].startswith("used")
+    assert not any(entry.startswith("old") for entry in os.listdir(tmp_path / "visits"))
@@ -0,0 +1,59 @@
+import numpy as np
+
+from forest_engine import ForestEngine
+
+# Days compared between the exact and the binned model, the dashboard horizons
+REPORT_HORIZONS = (180, 360, 365, 1825)
+
+
+def grid_times(duration, dead, width=None, quantiles=None):
+    """Time grid the survival durations are snapped onto.
+
+    width gives a regular grid (e.g. 7 for weeks), quantiles places that many
+    bins at quantiles of the event times, so the grid is finest where deaths
+    are most frequent. The last grid point is the longest duration.
+    """
+    duration = np.asarray(duration, dtype=np.float64)
+    dead = np.asarray(dead).astype(bool)
+    if (width is None) == (quantiles is None):
+        raise ValueError("Give either a grid width or a number of quantiles")
+    if width is not None:
+        if width <= 0:
+            raise ValueError("Grid width must be positive")
+        grid = np.arange(1, np.ceil(duration.max() / width) + 1) * width
+    else:
+        if quantiles < 1:
+            raise ValueError("Number of quantiles must be at least 1")
+        event_times = duration[dead] if dead.any() else duration
+        grid = np.quantile(event_times, np.linspace(0, 1, int(quantiles) + 1)[1:])
+    return np.unique(np.append(grid[grid < duration.max()], duration.max()))
+
+
+def discretize(y, grid, time_field="Survival Duration (Days)"):
+    # Move every duration up to the next grid point, events and censorings alike
+    binned = y.copy()
+    index = np.searchsorted(grid, binned[time_field], side="left")
+    binned[time_field] = grid[np.minimum(index, len(grid) - 1)]
+    return binned
+
+
+def grid_report(exact, binned, X_test, y_test, horizons=REPORT_HORIZONS):
+    """Concordance and horizon survival of the binned model against the exact one, on the test rows."""
+    horizons = list(horizons)
+    exact_survival = ForestEngine.from_model(exact, horizons).predict_survival_at(X_test, horizons)
+    binned_survival = ForestEngine.from_model(binned, horizons).predict_survival_at(X_test, horizons)
+    drift = np.abs(binned_survival - exact_survival)
+
+    exact_c_index = float(exact.score(X_test, y_test))
+    binned_c_index = float(binned.score(X_test, y_test))
+    return {
+        "c_index_exact": round(exact_c_index, 4),
+        "c_index_binned": round(binned_c_index, 4),
+        "c_index_drift": round(binned_c_index - exact_c_index, 4),
+        "horizon_drift": {
+            str(days): {"mean_abs": round(float(drift[:, i].mean()), 4), "max_abs": round(float(drift[:, i].max()), 4)}
+            for i, days in enumerate(horizons)
+        },
+        "unique_times_exact": len(exact.unique_times_),
+        "unique_times_binned": len(binned.unique_times_),
+    }
@@ -1,50 +1,27 @@
-import psycopg2
+import sys
 import pandas as pd
 import numpy as np
-import pickle 
+import model_artifact
+import db
 from sksurv.ensemble import RandomSurvivalForest
 from sklearn.model_selection import train_test_split
-from datetime import datetime
-from lifelines.fitters.coxph_fitter import CoxPHFitter
-
-# Connect to database 
-conn = psycopg2.connect(
-    database="cghdb",
-    user="postgres",
-    password="cghrespi",
-    host="localhost",
-    port="5432"
-)
-cur = conn.cursor()  
-
-# Fetch userid and email from users table
-cur.execute("SELECT userid, email FROM users")
-users = cur.fetchall()
-
-if not users:
-    raise Exception("User not found in the database.")
-
-for userid, email in users:
-    print(f"User Found - ID: {userid}, Email: {email}")
+from model_search import search_forest
+from time_grid import grid_times, discretize, grid_report
+from evaluation import model_report
+from cox_predictor import fit_cox_predictor
+from feature_matrix import survival_target
 
 # Load dataset
 df = pd.read_csv("website_df_14112024_1.0.csv")
 
 # Convert event and time columns into a structured survival array
-data_y = df.apply(lambda row: (row["Dead"] == 1, row["Survival Duration (Days)"]), axis=1).to_numpy(dtype=[("Dead", "?"), ("Survival Duration (Days)", "<f8")])
+data_y = survival_target(df["Dead"], df["Survival Duration (Days)"])
 
 # Define predictor variables
 exclude_columns = ["Patient ID", "Dead", "Survival Duration (Days)","Readmission", "Gender", "Age"]
 diagnostic_codes = [col for col in df.columns if col not in exclude_columns]
 X = df.drop(columns=["Dead", "Survival Duration (Days)"])
 
-#Save the diagnostic codes in database 
-# Clearing existing codes to avoid duplicates
-cur.execute("DELETE FROM diagnostic_codes")
-for code in diagnostic_codes:
-    cur.execute("INSERT INTO diagnostic_codes (code_name) VALUES (%s) ON CONFLICT DO NOTHING;", (code,))
-conn.commit()
-
 # Split into training and testing sets
 X_train, X_test, y_train, y_test = train_test_split(X, data_y, test_size=0.2, random_state=42)
 
@@ -57,31 +34,58 @@ if "Patient ID" in X_train.columns:
 X_train = X_train.drop(columns=["Patient ID"])
 X_test = X_test.drop(columns=["Patient ID"])
 
+# python train_model.py --search picks the hyperparameters by cross-validation on the training split
+params = dict(n_estimators=100, min_samples_split=10, min_samples_leaf=15, max_features="sqrt")
+cv_scores = None
+if "--search" in sys.argv[1:]:
+    search_result = search_forest(X_train.to_numpy(dtype=np.float32), y_train)
+    params = search_result["best_params"]
+    cv_scores = {"folds": search_result["folds"], "fold_scores": search_result["fold_scores"], "mean_score": search_result["best_score"]}
+    print(f"Best parameters: {params} (mean concordance {search_result['best_score']:.3f})")
+
+# python train_model.py --time-grid 7 (days) or --time-grid-quantiles 100 fits on binned durations
+time_grid = None
+for flag, key, kind in [("--time-grid", "width", float), ("--time-grid-quantiles", "quantiles", int)]:
+    if flag in sys.argv[1:]:
+        time_grid = {key: kind(sys.argv[sys.argv.index(flag) + 1])}
+y_fit = y_train
+if time_grid is not None:
+    y_fit = discretize(y_train, grid_times(y_train["Survival Duration (Days)"], y_train["Dead"], **time_grid))
+
 #Train Random Survival Forest model
-rsf = RandomSurvivalForest(n_estimators=100, min_samples_split=10, min_samples_leaf=15, max_features="sqrt", n_jobs=-1, random_state=42)
-rsf.fit(X_train, y_train)
+rsf = RandomSurvivalForest(**params, n_jobs=-1, random_state=42)
+rsf.fit(X_train, y_fit)
 
-c_index = rsf.score(X_test, y_test)
+# Concordance, time-dependent AUC and Brier score with bootstrap intervals
+model_metrics = model_report(rsf, X_test, y_test, y_train)
+c_index = model_metrics.pop("c_index_exact")
 print(f"Concordance Index: {c_index:.3f}")
 c_index = round(float(c_index),3)
 
-#Serialize model using pickle to store in DB
-model_binary = pickle.dumps(rsf)
-
-#Insert model into PostgreSQL
-cur.execute("""
-    INSERT INTO models (timestamp, model_data, c_index)
-    VALUES (%s, %s, %s)
-    RETURNING modelid;
-""", (datetime.now(), model_binary, c_index))
-
-#Retrieve the new modelid
-modelid = cur.fetchone()[0]
-conn.commit()
-
-print(f"Model saved in database for User - ID: {userid}, Email: {email} (Model ID: {modelid})")
+# Cox predictor for the dashboard's fast prediction mode, stored in the model header
+cox = fit_cox_predictor(X_train, y_train, X_test.to_numpy(dtype=np.float64), y_test, X_train.columns)
+model_metrics["cox_c_index"] = None if cox is None else cox["c_index"]
+if cox is not None:
+    print(f"Cox Concordance Index: {cox['c_index']:.3f}")
+
+# Drift of the binned model against one fitted on the exact durations
+report = None
+if time_grid is not None:
+    exact = RandomSurvivalForest(**params, n_jobs=-1, random_state=42)
+    exact.fit(X_train, y_train)
+    report = grid_report(exact, rsf, X_test, y_test)
+    print(f"Time grid {time_grid}: {report}")
+    params = dict(params, time_grid=time_grid)
+
+#Serialize model as a compressed artifact to store in DB
+model_binary = model_artifact.dumps(
+    rsf, c_index=c_index, cv_scores=cv_scores, codes=diagnostic_codes, time_grid=time_grid, grid_report=report, cox=cox
+)
 
-# close connection
-cur.close()
-conn.close()
+#Save the diagnostic codes and the model in one transaction, through the shared connection pool
+with db.connection() as conn:
+    added, removed = db.sync_codes(conn, diagnostic_codes)
+    print(f"Diagnostic codes: {len(added)} added, {len(removed)} removed")
+    modelid = db.insert_model(conn, model_binary, c_index, params, cv_scores, model_metrics)
 
+print(f"Model saved in database (Model ID: {modelid})")
@@ -3,11 +3,12 @@ import { Alert, Button } from 'antd';
 import * as XLSX from 'xlsx';
 import { Table, Spin } from 'antd';
 
-const PreviewFile = ({ file, proceed, prev }) => {
+const PreviewFile = ({ file, uploadJob, proceed, prev }) => {
   const [data, setData] = useState([]);
   const [columns, setColumns] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [jobStage, setJobStage] = useState(null);
 
   const headers = [
     "Admit/Visit Date/Time",
@@ -22,22 +23,54 @@ const PreviewFile = ({ file, proceed, prev }) => {
     "Patient ID"
   ];
 
+  // Poll a background job until it has finished
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const response = await fetch(`http://localhost:5002/jobs/${jobId}`);
+      const job = await response.json();
+      if (!response.ok || ["done", "failed", "cancelled"].includes(job.state)) {
+        return job;
+      }
+      setJobStage(`${job.stage} (${Math.round(job.progress * 100)}%)`);
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleProceed = async () => {
+    if (!uploadJob) {
+      alert("The file is still uploading. Please try again in a moment.");
+      return;
+    }
     try {
-      const response = await fetch("http://localhost:5002/train", {
+      const upload = await waitForJob(uploadJob);
+      if (upload.state !== "done") {
+        alert(upload.error || upload.message || `File processing ${upload.state}`);
+        return;
+      }
+
+      const response = await fetch("http://localhost:5002/jobs/train", {
         method: 'POST',
         headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ upload_job_id: uploadJob }),
       });
-      const result = await response.text();
-      if (response.ok) {
+      const submitted = await response.json();
+      if (!response.ok) {
+        alert(submitted.message);
+        return;
+      }
+
+      const result = await waitForJob(submitted.id);
+      if (result.state === "done") {
         alert("Model Training Successful!");
         proceed();
       } else {
-        alert(result.error);
+        alert(result.error || `Model training ${result.state}`);
       }
     } catch (error) {
       alert("Failed to start model training. Please try again!");
       console.error(error);
+    } finally {
+      setJobStage(null);
     }
   };
   
@@ -137,6 +170,7 @@ const PreviewFile = ({ file, proceed, prev }) => {
   return (
     <div>
       {error && <Alert message={error} type="error" showIcon />}
+      {jobStage && <Alert message={jobStage} type="info" showIcon />}
       {loading ? (
         <div className="loading">
           <Spin size="large"/>
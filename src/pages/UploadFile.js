@@ -5,7 +5,7 @@ import ExcelTemplate from './downloadExcel';
 
 const { Dragger } = Upload;
 
-const UploadFile = ({ alert, setFile, fileupload, uploadModel }) => {
+const UploadFile = ({ alert, setFile, setUploadJob, fileupload, uploadModel }) => {
   const [fileList, setFileList] = useState([]);
   const [uploading, setUploading] = useState(false);
   const [uploadAlert, setUploadAlert] = useState(null);
@@ -23,14 +23,28 @@ const UploadFile = ({ alert, setFile, fileupload, uploadModel }) => {
 
     setUploading(true);
 
-    fetch('http://localhost:5002/fileUpload', {
+    // Preprocessing runs as a background job, the preview step waits for it before training
+    fetch('http://localhost:5002/jobs/preprocess', {
       method: 'POST',
       body: formData,
     })
-      .then((res) => res.json())
-      .then(() => {
+      .then(async (res) => {
+        const data = await res.json();
+        if (!res.ok) {
+          // e.g. invalid diagnoses or shards fields, no job was created
+          setUploadAlert(
+            <Alert
+              description={data.message || 'Upload failed.'}
+              type="error"
+              showIcon
+            />
+          );
+          return;
+        }
+        setUploadJob(data.id);
         setFileList([]);
         setUploadAlert(null);
+        uploadModel();
       })
       .catch(() => {
         message.error('Upload failed.');
@@ -111,10 +125,7 @@ const UploadFile = ({ alert, setFile, fileupload, uploadModel }) => {
           className="btns"
           style={{ width: '20%' }}
           type="primary"
-          onClick={async () => {
-            await handleUpload();
-            uploadModel();
-          }}
+          onClick={handleUpload}
           loading={uploading}
           disabled={fileList.length === 0}
         >
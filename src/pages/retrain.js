@@ -13,6 +13,8 @@ const Retrain = ({ email }) => {
     const [current, setCurrent] = useState(0);
     //store uploaded excel file
     const [file, setFile] = useState(null);
+    //store id of the preprocessing job of the uploaded file
+    const [uploadJob, setUploadJob] = useState(null);
     const prev = () => {
         setCurrent((prev) => prev - 1);
 
@@ -31,11 +33,11 @@ const Retrain = ({ email }) => {
     const steps = [
         {
             title: 'Upload File',
-            content: <UploadFile alert={setalert} setFile={setFile} fileupload={setfileupload} uploadModel={uploadModel} />,
+            content: <UploadFile alert={setalert} setFile={setFile} setUploadJob={setUploadJob} fileupload={setfileupload} uploadModel={uploadModel} />,
         },
         {
             title: 'Preview file',
-            content:  <PreviewFile file={file} proceed={proceed} prev={prev}/>, 
+            content:  <PreviewFile file={file} uploadJob={uploadJob} proceed={proceed} prev={prev}/>, 
         },
         {
             title: 'Train Model',